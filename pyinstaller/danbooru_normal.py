@@ -1,7 +1,11 @@
+from multiprocessing import freeze_support
+from time import sleep
 from danbooru_favourites_downloader import main as _main
 
 def main():
     _main.main(_main.DownloadMode.NORMAL)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    freeze_support() # ugoira conversion uses a process pool
+    main()
+    sleep(2) # keeps the console window of the executable open long enough to read the summary
\ No newline at end of file
@@ -0,0 +1,87 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import monotonic
+
+THROUGHPUT_GAIN = 1.05 # a window has to be this much faster before another slot is added
+LATENCY_BACKOFF = 2.0 # average latency this many times the best window counts as congestion
+
+
+@dataclass
+class Sample:
+    status: int | None = None # None when no request was made, 0 when it failed without a response
+    size: int = 0
+    epoch: int = 0 # decreases done when the slot was acquired
+
+
+class ConcurrencyController:
+    '''
+    AIMD limit for parallel downloads.
+    After every window of `limit` completed downloads one slot is added while throughput keeps rising,
+    the limit is halved on 429/5xx responses, connection errors or when latency climbs well above the best window seen.
+    Like TCP once per round trip, failures of downloads started before the last decrease don't halve it again.
+    '''
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.active = 0
+        self.peak_limit = self.limit
+        self.epoch = 0
+        self.best_latency: float | None = None
+        self.last_throughput = 0.0
+        self._condition = asyncio.Condition()
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_start = monotonic()
+        self.window_count = 0
+        self.window_bytes = 0
+        self.window_latency = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        sample = Sample(epoch=self.epoch)
+        start = monotonic()
+        try:
+            yield sample
+        finally:
+            self.record(sample.status, sample.size, monotonic() - start, sample.epoch)
+            async with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    def record(self, status: int | None, size: int, latency: float, epoch: int | None = None):
+        if status is None:
+            return
+        if status == 0 or status == 429 or status >= 500:
+            if epoch is None or epoch == self.epoch: # otherwise the decrease already answered this congestion
+                self._decrease()
+            return
+        self.window_count += 1
+        self.window_bytes += size
+        self.window_latency += latency
+        if self.window_count < self.limit:
+            return
+
+        throughput = self.window_bytes / max(monotonic() - self.window_start, 1e-6)
+        average_latency = self.window_latency / self.window_count
+        if self.best_latency is None or average_latency < self.best_latency:
+            self.best_latency = average_latency
+        if average_latency > self.best_latency * LATENCY_BACKOFF and throughput <= self.last_throughput:
+            self._decrease()
+            return
+        if throughput > self.last_throughput * THROUGHPUT_GAIN and self.limit < self.maximum:
+            self.limit += 1
+            self.peak_limit = max(self.peak_limit, self.limit)
+        self.last_throughput = throughput
+        self._reset_window()
+
+    def _decrease(self):
+        self.limit = max(self.minimum, self.limit // 2)
+        self.epoch += 1
+        self.last_throughput = 0.0 # the next window has to prove itself again
+        self._reset_window()
@@ -1,5 +1,17 @@
 import sqlite3
+import string
 from dataclasses import dataclass
+from time import monotonic
+
+TAG_CATEGORIES = {
+    'general': 'tag_string_general',
+    'character': 'tag_string_character',
+    'copyright': 'tag_string_copyright',
+    'artist': 'tag_string_artist',
+    'meta': 'tag_string_meta',
+}
+# Danbooru tags may contain any punctuation, so only whitespace separates tokens in the search index
+FTS_TOKENIZER = "ascii tokenchars '" + string.punctuation.replace("'", "''") + "'"
 
 @dataclass
 class PostMetaData:
@@ -15,12 +27,27 @@ class PostMetaData:
     has_children: bool = False
     has_active_children: bool = False
     file_ext: str = ""
+    file_path: str = "" # relative to FILE_DIRECTORY, empty for files downloaded before paths were recorded
+    variant: str = "original" # media_asset variant that was downloaded, md5 is the hash of that file
+    api_md5: str = "" # md5 Danbooru reports, only kept when md5 is the hash of a different file. The md5 layout is keyed on it
 
 
 class Database:
-    def __init__(self, path):
+    '''
+    Post and error rows are buffered and written with executemany once `flush_rows` rows are pending
+    or `flush_interval` seconds passed, each flush is committed. A crash loses at most that much bookkeeping.
+    '''
+    def __init__(self, path, flush_rows:int = 500, flush_interval:float = 5.0):
         self.con = sqlite3.connect(path)
         self.cur = self.con.cursor()
+        self.cur.execute("PRAGMA journal_mode=WAL")
+        self.cur.execute("PRAGMA synchronous=NORMAL") # WAL keeps the database consistent, only the last commits may be lost on power loss
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.last_flush = monotonic()
+        self.pending_posts:list[tuple] = []
+        self.pending_errors:list[tuple] = []
+        self.pending_settled:list[tuple] = []
         self.create_tables()
     
     def create_tables(self):
@@ -37,7 +64,10 @@ class Database:
             parent_id INTEGER,
             has_children BOOLEAN NOT NULL,
             has_active_children BOOLEAN NOT NULL,
-            file_ext TEXT
+            file_ext TEXT,
+            file_path TEXT,
+            variant TEXT,
+            api_md5 TEXT
         );""",
         """CREATE TABLE IF NOT EXISTS error (
             post_id INTEGER PRIMARY KEY
@@ -51,21 +81,107 @@ class Database:
         self.cur.execute(sql_create_table_queries[0])
         self.cur.execute(sql_create_table_queries[1])
         self.cur.execute(sql_create_table_queries[2])
+        self.add_missing_columns()
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS posts_by_md5 ON posts (md5);""")
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS file_hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            md5 TEXT NOT NULL
+        );""")
+        # posts of the current run that were listed but aren't downloaded or recorded as failed yet
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS run_queue (
+            post_id INTEGER PRIMARY KEY
+        );""")
+        self.create_tag_tables()
+
+    def add_missing_columns(self):
+        # databases created by older versions
+        columns = {row[1] for row in self.cur.execute("PRAGMA table_info(posts)")}
+        for column in ('file_path', 'variant', 'api_md5'):
+            if column not in columns:
+                self.cur.execute(f"ALTER TABLE posts ADD COLUMN {column} TEXT")
+                self.con.commit()
+
+    def create_tag_tables(self):
+        fts_exists = self.cur.execute("SELECT 1 FROM sqlite_master WHERE name='posts_fts'").fetchone() is not None
+        columns = ", ".join(TAG_CATEGORIES.values())
+        new_columns = ", ".join(f"new.{c}" for c in TAG_CATEGORIES.values())
+        old_columns = ", ".join(f"old.{c}" for c in TAG_CATEGORIES.values())
+        sql_create_tag_queries = [
+        """CREATE TABLE IF NOT EXISTS tags (
+            tag_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            category TEXT NOT NULL
+        );""",
+        """CREATE TABLE IF NOT EXISTS post_tags (
+            post_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            PRIMARY KEY (post_id, tag_id)
+        ) WITHOUT ROWID;""",
+        """CREATE INDEX IF NOT EXISTS post_tags_by_tag ON post_tags (tag_id, post_id);""",
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            {columns},
+            content='posts', content_rowid='post_id',
+            tokenize="{FTS_TOKENIZER.replace('"', '""')}"
+        );""",
+        f"""CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, {columns}) VALUES (new.post_id, {new_columns});
+        END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, {columns}) VALUES ('delete', old.post_id, {old_columns});
+        END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, {columns}) VALUES ('delete', old.post_id, {old_columns});
+            INSERT INTO posts_fts (rowid, {columns}) VALUES (new.post_id, {new_columns});
+        END;"""
+        ]
+        for query in sql_create_tag_queries:
+            self.cur.execute(query)
+
+        # Backfill libraries downloaded before the tag tables existed
+        if not fts_exists:
+            self.cur.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        untagged = self.cur.execute(f"""SELECT post_id, {columns} FROM posts p
+                                        WHERE NOT EXISTS (SELECT 1 FROM post_tags pt WHERE pt.post_id = p.post_id)""").fetchall()
+        if untagged:
+            self._write_post_tags(untagged)
+            self.con.commit()
+
+    def _write_post_tags(self, rows:list[tuple]):
+        # rows are (post_id, general, character, copyright, artist, meta)
+        tags:dict[str, str] = {}
+        post_tags:list[tuple] = []
+        for post_id, *tag_strings in rows:
+            for category, tag_string in zip(TAG_CATEGORIES, tag_strings):
+                for tag in (tag_string or "").split():
+                    tags[tag] = category
+                    post_tags.append((post_id, tag))
+        self.cur.executemany("DELETE FROM post_tags WHERE post_id = ?", [(row[0],) for row in rows])
+        self.cur.executemany("""INSERT INTO tags (name, category) VALUES (?,?)
+                                ON CONFLICT (name) DO UPDATE SET category=excluded.category""", tags.items())
+        self.cur.executemany("""INSERT OR IGNORE INTO post_tags (post_id, tag_id)
+                                SELECT ?, tag_id FROM tags WHERE name = ?""", post_tags)
 
     def delete_tables(self) -> None: 
+        self.pending_posts = []
+        self.pending_errors = []
+        self.pending_settled = []
         sql_drop_table_queries = [ 
         """DELETE FROM error;""",
+        """DELETE FROM run_queue;""",
         """DELETE FROM posts;""",
-        """DELETE FROM key_value_pairs;"""
+        """DELETE FROM key_value_pairs;""",
+        """DELETE FROM post_tags;""",
+        """DELETE FROM tags;"""
         ]
 
-        self.cur.execute(sql_drop_table_queries[0])
-        self.cur.execute(sql_drop_table_queries[1])
-        self.cur.execute(sql_drop_table_queries[2])
+        for query in sql_drop_table_queries:
+            self.cur.execute(query)
 
 
     def insert_post_data(self, data:PostMetaData):
-        query_data = (data.post_id,
+        self.pending_posts.append((data.post_id,
                 data.md5,
                 data.tag_string_general,
                 data.tag_string_character,
@@ -76,34 +192,80 @@ class Database:
                 data.parent_id,
                 data.has_children,
                 data.has_active_children,
-                data.file_ext)
-
-        query = """INSERT INTO posts (
-                    post_id,
-                    md5,
-                    tag_string_general,
-                    tag_string_character,
-                    tag_string_copyright,
-                    tag_string_artist,
-                    tag_string_meta,
-                    rating,
-                    parent_id,
-                    has_children,
-                    has_active_children,
-                    file_ext)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"""
-        self.cur.execute(query, query_data)
+                data.file_ext,
+                data.file_path or None,
+                data.variant,
+                data.api_md5 or None))
+        self._flush_if_due()
+
+    def _write_pending(self):
+        if self.pending_posts:
+            query = """INSERT INTO posts (
+                        post_id,
+                        md5,
+                        tag_string_general,
+                        tag_string_character,
+                        tag_string_copyright,
+                        tag_string_artist,
+                        tag_string_meta,
+                        rating,
+                        parent_id,
+                        has_children,
+                        has_active_children,
+                        file_ext,
+                        file_path,
+                        variant,
+                        api_md5)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                    ON CONFLICT (post_id) DO UPDATE SET
+                        md5=excluded.md5,
+                        tag_string_general=excluded.tag_string_general,
+                        tag_string_character=excluded.tag_string_character,
+                        tag_string_copyright=excluded.tag_string_copyright,
+                        tag_string_artist=excluded.tag_string_artist,
+                        tag_string_meta=excluded.tag_string_meta,
+                        rating=excluded.rating,
+                        parent_id=excluded.parent_id,
+                        has_children=excluded.has_children,
+                        has_active_children=excluded.has_active_children,
+                        file_ext=excluded.file_ext,
+                        file_path=excluded.file_path,
+                        variant=excluded.variant,
+                        api_md5=excluded.api_md5"""
+            self.cur.executemany(query, self.pending_posts)
+            self._write_post_tags([(row[0], *row[2:7]) for row in self.pending_posts])
+            self.pending_posts = []
+        if self.pending_errors:
+            query = """INSERT OR IGNORE INTO error (
+                        post_id)
+                    VALUES (?)"""
+            self.cur.executemany(query, self.pending_errors)
+            self.pending_errors = []
+        if self.pending_settled: # after the rows above, so a post is never settled without its outcome
+            self.cur.executemany("DELETE FROM run_queue WHERE post_id = ?", self.pending_settled)
+            self.pending_settled = []
 
+    def _flush_if_due(self):
+        pending = len(self.pending_posts) + len(self.pending_errors) + len(self.pending_settled)
+        if pending >= self.flush_rows or monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
 
-    def set_newest_downloaded_id(self, id:int):
-        query_data = ("newest_id", str(id))
+    def flush(self):
+        self._write_pending()
+        self.con.commit()
+        self.last_flush = monotonic()
+
+
+    def set_newest_downloaded_id(self, id:int, source:str = ''):
+        # every download source keeps its own checkpoint, the account's own favourites use the original key
+        query_data = (source_key("newest_id", source), str(id))
         query = """INSERT INTO key_value_pairs (key, value)
                         VALUES(?,?)
                         ON CONFLICT (key) DO UPDATE SET value=excluded.value"""
         self.cur.execute(query, query_data)
 
-    def get_newest_downloaded_id(self) -> int:
-        ret = self.cur.execute("SELECT value FROM key_value_pairs WHERE key='newest_id'")
+    def get_newest_downloaded_id(self, source:str = '') -> int:
+        ret = self.cur.execute("SELECT value FROM key_value_pairs WHERE key=?", (source_key("newest_id", source),))
         ret_tuple = ret.fetchone()
         if ret_tuple is None:
             return 0
@@ -111,14 +273,44 @@ class Database:
             return int(ret_tuple[0])
 
 
+    def get_run_state(self, source:str = '') -> tuple[int, str] | None:
+        # newest id and next listing page of a run that was interrupted before its listing was finished
+        newest = self.cur.execute("SELECT value FROM key_value_pairs WHERE key=?", (source_key("run_newest", source),)).fetchone()
+        page = self.cur.execute("SELECT value FROM key_value_pairs WHERE key=?", (source_key("run_page", source),)).fetchone()
+        if newest is None or page is None:
+            return None
+        return int(newest[0]), page[0]
+
+    def set_run_state(self, newest_id:int, page:int | str, source:str = ''):
+        query = """INSERT INTO key_value_pairs (key, value)
+                        VALUES(?,?)
+                        ON CONFLICT (key) DO UPDATE SET value=excluded.value"""
+        self.cur.executemany(query, [(source_key("run_newest", source), str(newest_id)), (source_key("run_page", source), str(page))])
+
+    def finish_run(self, source:str = ''):
+        # the listing is done and every post of it settled, so the watermark may move forward
+        state = self.get_run_state(source)
+        if state is not None:
+            self.set_newest_downloaded_id(state[0], source)
+        self.cur.executemany("DELETE FROM key_value_pairs WHERE key=?", [(source_key("run_newest", source),), (source_key("run_page", source),)])
+
+    def queue_posts(self, ids:list[int]):
+        self.cur.executemany("INSERT OR IGNORE INTO run_queue (post_id) VALUES (?)", [(id,) for id in ids])
+
+    def settle_post(self, id:int):
+        self.pending_settled.append((id,))
+        self._flush_if_due()
+
+    def get_queued_ids(self) -> list[int]:
+        self._write_pending()
+        return [row[0] for row in self.cur.execute("SELECT post_id FROM run_queue ORDER BY post_id DESC")]
+
     def insert_id_to_error(self, id:int):
-        query_data = (str(id),)
-        query = """INSERT INTO error (
-                    post_id)
-                VALUES (?)"""
-        self.cur.execute(query, query_data)
+        self.pending_errors.append((str(id),))
+        self._flush_if_due()
 
     def get_error_ids(self) -> list:
+        self._write_pending()
         query_data = ()
         query = """SELECT post_id FROM error"""
         ret = self.cur.execute(query, query_data)
@@ -129,19 +321,112 @@ class Database:
         return ids
 
     def remove_from_error(self, id) -> None:
+        if self.pending_errors:
+            self.pending_errors = [row for row in self.pending_errors if row[0] != str(id)]
         query_data = (id,)
         query = """DELETE FROM error WHERE post_id = ?"""
         self.cur.execute(query, query_data)
 
 
+    def get_post(self, post_id:int) -> tuple[str, str, str | None] | None:
+        self._write_pending()
+        return self.cur.execute("SELECT md5, file_ext, file_path FROM posts WHERE post_id = ?", (post_id,)).fetchone()
+
+    def get_post_ids(self) -> set[int]:
+        self._write_pending()
+        return {row[0] for row in self.cur.execute("SELECT post_id FROM posts")}
+
+    def get_all_posts(self) -> list[tuple[int, str, str, str | None]]:
+        self._write_pending()
+        return self.cur.execute("SELECT post_id, md5, file_ext, file_path FROM posts").fetchall()
+
+    def get_post_locations(self) -> list[tuple[int, str, str, str | None]]:
+        # (post_id, md5 the layout is keyed on, file_ext, file_path)
+        self._write_pending()
+        return self.cur.execute("SELECT post_id, COALESCE(api_md5, md5), file_ext, file_path FROM posts").fetchall()
+
+    def set_file_path(self, post_id:int, file_path:str):
+        self._write_pending()
+        self.cur.execute("UPDATE posts SET file_path = ? WHERE post_id = ?", (file_path, post_id))
+        self._flush_if_due()
+
+    def get_cached_md5(self, path:str, size:int, mtime_ns:int) -> str | None:
+        # only valid while the file keeps the size and modification time it had when it was hashed
+        ret = self.cur.execute("SELECT md5 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns))
+        ret_tuple = ret.fetchone()
+        return None if ret_tuple is None else ret_tuple[0]
+
+    def cache_md5(self, path:str, size:int, mtime_ns:int, md5:str):
+        query = """INSERT INTO file_hashes (path, size, mtime_ns, md5) VALUES (?,?,?,?)
+                   ON CONFLICT (path) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, md5=excluded.md5"""
+        self.cur.execute(query, (path, size, mtime_ns, md5))
+        self._flush_if_due()
+
+    def move_cached_md5(self, old_path:str, new_path:str):
+        # a rename keeps size and modification time, so the cached hash stays valid
+        self.cur.execute("DELETE FROM file_hashes WHERE path = ?", (new_path,))
+        self.cur.execute("UPDATE file_hashes SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def get_posts_by_md5(self, md5:str) -> list[tuple[int, str, str | None]]:
+        self._write_pending()
+        return self.cur.execute("SELECT post_id, file_ext, file_path FROM posts WHERE md5 = ?", (md5,)).fetchall()
+
+    def search_posts(self, query:str) -> list[tuple[int, str, str | None]]:
+        self._write_pending()
+        match_query, params = build_search_query(query)
+        return self.cur.execute(match_query, params).fetchall()
+
     def commit(self):
-        self.con.commit()
+        self.flush()
 
     def close(self):
+        self.flush()
         self.con.close()
     
     def __enter__(self):
         return self
     
     def __exit__(self, exc_type, exc, tb):
-        self.close()
\ No newline at end of file
+        self.close()
+
+
+def source_key(name:str, source:str) -> str:
+    # key_value_pairs key of a per-source value, the account's own favourites use the plain name
+    return name if source == '' else f"{name}:{source}"
+
+def fts_term(term:str) -> str:
+    column = None
+    category, _, tag = term.partition(':')
+    if tag and category in TAG_CATEGORIES:
+        column, term = TAG_CATEGORIES[category], tag
+    prefix = term.endswith('*')
+    phrase = '"' + term.rstrip('*').replace('"', '""') + '"' + ('*' if prefix else '')
+    return f'{column} : {phrase}' if column else phrase
+
+def build_search_query(query:str) -> tuple[str, list]:
+    '''
+    Danbooru-style tag search: `tag` must be present, `-tag` must not be, `tag*` matches a prefix,
+    `artist:name` (or general/character/copyright/meta) limits a tag to one category,
+    `rating:g,s` / `-rating:e` filter by rating.
+    '''
+    include, exclude, conditions, params = [], [], [], []
+    for term in query.lower().split():
+        negated = term.startswith('-') and len(term) > 1
+        term = term[1:] if negated else term
+        if term.startswith('rating:'):
+            ratings = [r[0] for r in term.removeprefix('rating:').split(',') if r]
+            conditions.append(f"rating {'NOT IN' if negated else 'IN'} ({','.join('?' * len(ratings))})")
+            params.extend(ratings)
+        elif negated:
+            exclude.append(fts_term(term))
+        else:
+            include.append(fts_term(term))
+
+    if include:
+        conditions.append("post_id IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)")
+        params.append(" AND ".join(include))
+    if exclude:
+        conditions.append("post_id NOT IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)")
+        params.append(" OR ".join(exclude))
+    where = " AND ".join(conditions) or "1"
+    return f"SELECT post_id, file_ext, file_path FROM posts WHERE {where} ORDER BY post_id DESC", params
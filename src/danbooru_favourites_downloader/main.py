@@ -1,25 +1,43 @@
+from __future__ import annotations
 from sys import exit as sys_exit
 from sys import argv as sys_argv
+from sys import stderr as sys_stderr
 import os
+import shutil
 from .database import Database, PostMetaData
-from dotenv import load_dotenv
+from .rate_limiter import RateLimiter, parse_retry_after
+from .concurrency import ConcurrencyController
+from .metrics import Metrics
 import asyncio
-import aiohttp
-from alive_progress import alive_bar
-from time import sleep, time
+from time import monotonic
 from enum import Enum, auto
-from PIL import Image
-import zipfile
-import json
-import io
 from hashlib import md5
+import random
 from dataclasses import dataclass, field
+from contextlib import asynccontextmanager, aclosing
+import signal
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, NamedTuple, TYPE_CHECKING
+try:
+    from orjson import loads as json_loads # optional, decodes the API responses several times faster
+except ImportError:
+    from json import loads as json_loads
+
+# aiohttp, alive_progress, dotenv and Pillow (through .ugoira) are imported where they are needed,
+# so --help, search and verify don't pay for loading them
+if TYPE_CHECKING:
+    import aiohttp
 
 class DownloadMode(Enum):
     NONE = "none"
     NORMAL = "normal"
     RETRY  = "retry"
     FORCE  = "force"
+    RECONCILE = "reconcile"
+    VERIFY = "verify" # local only, checks the downloaded files against their md5
+    SEARCH = "search" # local only, searches the tags of downloaded posts
+    WATCH = "watch" # stays running and downloads new posts as they show up
+    MIGRATE = "migrate" # local only, moves downloaded files into FILE_LAYOUT
 
 @dataclass
 class Environment:
@@ -28,12 +46,85 @@ class Environment:
     db_location: str
     file_directory: str
     convert_ugoira_to_webp: bool
+    rate_limit: float = 10.0 # requests per second once the burst is used up
+    rate_limit_burst: int = 100
+    conversion_workers: int = 1
+    max_downloads: int = 16 # upper bound for the adaptive download concurrency
+    download_retries: int = 3 # extra attempts for a download that failed with a transient error
+    metrics_file: str = '' # JSON report of the run, defaults to run-metrics.json next to the database
+    prometheus_textfile: str = ''
+    base_url: str = 'https://danbooru.donmai.us'
+    file_layout: str = 'flat' # flat, id or md5, see layout_file_path
+    watch_interval: float = 60.0 # seconds between two checks in watch mode
+    sources: str = '' # ';' separated list of favourites:<user>, tags:<query> and pool:<id>, empty for the account's own favourites
+    file_variant: str = 'original' # original, max_pixels:<n>, format:<ext> or max_bytes:<n>, see choose_variant
+
+@dataclass(frozen=True)
+class Source:
+    name: str # as written in SOURCES
+    tags: str # search that lists the posts
+    checkpoint: str = '' # key of the newest-id checkpoint, empty for the account's own favourites
 
 @dataclass
 class Urls:
     base_url: str
-    search_result_endpoint: str # requires post:index key access
-    specific_post_endpoint: str # requires post:show  key access
+    search_result_endpoint: str # requires post:index key access, retry mode searches by id as well
+
+class VariantPolicy(NamedTuple):
+    kind: str = 'original' # one of VARIANT_KINDS
+    limit: int = 0 # pixels for max_pixels, bytes for max_bytes
+    file_ext: str = '' # for format
+
+@dataclass(slots=True)
+class PostRecord:
+    # what the downloader uses of a post, the API JSON with its media_asset variants is several KB per post
+    id: int
+    md5: str = ''
+    file_ext: str = ''
+    file_url: str = ''
+    tag_string_general: str = ''
+    tag_string_character: str = ''
+    tag_string_copyright: str = ''
+    tag_string_artist: str = ''
+    tag_string_meta: str = ''
+    rating: str = ''
+    parent_id: int | None = None
+    has_children: bool = False
+    has_active_children: bool = False
+    duration: float | None = None # ugoira only
+    variant: str = 'original' # md5 only belongs to the original, file_url and file_ext are those of the variant
+
+    @classmethod
+    def from_json(cls, post: dict, policy: VariantPolicy = VariantPolicy()) -> PostRecord:
+        # restricted posts come without md5 and file_url, download_file turns those into error rows
+        record = cls(
+            post['id'],
+            post.get('md5', ''),
+            post.get('file_ext', ''),
+            post.get('file_url', ''),
+            post.get('tag_string_general', ''),
+            post.get('tag_string_character', ''),
+            post.get('tag_string_copyright', ''),
+            post.get('tag_string_artist', ''),
+            post.get('tag_string_meta', ''),
+            post.get('rating', ''),
+            post.get('parent_id'),
+            bool(post.get('has_children')),
+            bool(post.get('has_active_children')),
+            (post.get('media_asset') or {}).get('duration'),
+        )
+        variant = choose_variant(post, policy)
+        if variant is not None:
+            record.file_url, record.file_ext, record.variant = variant['url'], variant['file_ext'], variant['type']
+        return record
+
+class DownloadResult(NamedTuple):
+    success: bool
+    post: PostRecord
+    md5: str = "" # hash of the bytes written, computed while downloading
+    status: int | None = None # HTTP status, 0 if the request failed without one, None if nothing was requested
+    size: int = 0 # bytes fetched over the network
+    path: str = "" # where the file ends up, recorded in the database
 
 @dataclass
 class Context:
@@ -43,173 +134,609 @@ class Context:
     mode: DownloadMode
     authenticator: aiohttp.BasicAuth
     urls: Urls
-    rate_limit_interval: float
-    semaphore: asyncio.Semaphore
+    rate_limiter: RateLimiter
+    concurrency: ConcurrencyController
+    conversion_pool: Executor | None = None # None runs conversions on the default thread pool
+    listed_ids: set[int] | None = None # filled by reconcile mode to find local posts that are no longer listed
+    metrics: Metrics = field(default_factory=Metrics)
+    sources: list[Source] = field(default_factory=list) # empty lists the account's own favourites
+    seen_ids: set[int] = field(default_factory=set) # posts already queued by one of the sources
+    stopping: asyncio.Event = field(default_factory=asyncio.Event) # set by SIGINT/SIGTERM, the run winds down
+    variant_policy: VariantPolicy = VariantPolicy()
+
+MAX_THROTTLED_ATTEMPTS = 5
+RETRY_BATCH_SIZE = 100 # ids per id:1,2,3 search, the API allows a limit of up to 200
+PAGE_LIMIT = 200 # largest page size the API allows
+# what PostRecord is built from, a full post with its media_asset variants is several times larger
+POST_FIELDS = ('id,md5,file_url,file_ext,tag_string_general,tag_string_character,tag_string_copyright,tag_string_artist,'
+               'tag_string_meta,rating,parent_id,has_children,has_active_children,media_asset[duration]')
+VARIANT_POST_FIELDS = POST_FIELDS.replace('media_asset[duration]', 'media_asset[duration,file_size,image_width,image_height,variants]')
+VARIANT_KINDS = ('original', 'max_pixels', 'format', 'max_bytes')
+IMAGE_EXTS = ('jpg', 'jpeg', 'png', 'webp', 'avif') # the variants of animations and videos are stills, those keep their original
+SOURCE_KINDS = ('favourites', 'tags', 'pool')
+CUSTOM_ORDER_TAGS = ('order:', 'ordfav:', 'ordpool:', 'ordfavgroup:', 'random:')
+API_CONNECTIONS = 4 # connections kept for listing next to the downloads
+DNS_CACHE_SECONDS = 300
+INITIAL_DOWNLOADS = 4
+KEEPALIVE_SECONDS = 60
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+QUEUE_SIZE = 100 # posts listed ahead of the download workers
+CHUNK_SIZE = 65536
+VERIFY_CHUNK_SIZE = 1 << 20 # large reads let hashlib release the GIL for most of the time
+DEFAULT_CONVERSION_WORKERS = 2 # see ugoira.py for the memory used by each conversion
+MAX_CONVERSION_WORKERS = 8
+FILE_LAYOUTS = ('flat', 'id', 'md5')
+ID_SHARD_SIZE = 1000 # posts per directory in the id layout
+PARTIAL_SUFFIX = '.part' # files are only renamed to their final name once the md5 matched
+RETRY_BACKOFF_BASE = 1.0 # seconds, doubled for every further attempt
+RETRY_BACKOFF_CAP = 30.0
+
+@asynccontextmanager
+async def rate_limited_get(context:Context, url:str, **kwargs):
+    for attempt in range(MAX_THROTTLED_ATTEMPTS):
+        await context.rate_limiter.acquire()
+        async with context.session.get(url, **kwargs) as resp:
+            context.metrics.count_request(resp.status)
+            if resp.status == 429 and attempt < MAX_THROTTLED_ATTEMPTS - 1:
+                context.rate_limiter.penalize(parse_retry_after(resp.headers.get('Retry-After')))
+                continue
+            yield resp
+            return
+
+def post_fields(context: Context) -> str:
+    return POST_FIELDS if context.variant_policy.kind == 'original' else VARIANT_POST_FIELDS
+
+def parse_variant_policy(value: str) -> VariantPolicy:
+    kind, _, argument = value.strip().lower().partition(':')
+    if kind == 'original' and argument == '':
+        return VariantPolicy()
+    if kind in ('max_pixels', 'max_bytes') and argument.isdigit() and int(argument) > 0:
+        return VariantPolicy(kind, limit=int(argument))
+    if kind == 'format' and argument.isalnum():
+        return VariantPolicy(kind, file_ext=argument)
+    raise SystemExit("FILE_VARIANT must be original, max_pixels:<pixels>, format:<extension> or max_bytes:<bytes>")
+
+def variant_pixels(variant: dict) -> int:
+    return (variant.get('width') or 0) * (variant.get('height') or 0)
+
+def choose_variant(post: dict, policy: VariantPolicy) -> dict | None:
+    # None keeps the original
+    if policy.kind == 'original' or post.get('file_ext') not in IMAGE_EXTS:
+        return None
+    media_asset = post.get('media_asset') or {}
+    variants = sorted((variant for variant in media_asset.get('variants') or []
+                       if variant.get('type') != 'original' and variant.get('url') and variant.get('file_ext') in IMAGE_EXTS), key=variant_pixels)
+    original_pixels = (media_asset.get('image_width') or 0) * (media_asset.get('image_height') or 0)
+    if policy.kind == 'format':
+        if post['file_ext'] == policy.file_ext:
+            return None
+        matching = [variant for variant in variants if variant['file_ext'] == policy.file_ext]
+        return matching[-1] if matching else None
+    if policy.kind == 'max_pixels':
+        if original_pixels <= policy.limit:
+            return None
+        fitting = [variant for variant in variants if variant_pixels(variant) <= policy.limit]
+    else: # max_bytes, the API only has the size of the original, the others are estimated by their share of its pixels
+        file_size = media_asset.get('file_size') or 0
+        if file_size <= policy.limit or original_pixels == 0:
+            return None
+        fitting = [variant for variant in variants if file_size * variant_pixels(variant) / original_pixels <= policy.limit]
+    if fitting:
+        return fitting[-1]
+    return variants[0] if variants else None # nothing is small enough, the smallest comes closest
+
+async def read_json(context: Context, resp: aiohttp.ClientResponse):
+    body = await resp.read()
+    context.metrics.count('listing_bytes', len(body))
+    with context.metrics.time('decode'):
+        return json_loads(body)
 
-load_dotenv()
+async def get_error_posts_batch(context:Context, ids:list[int]) -> list[dict]:
+    params = {
+        'tags': f'id:{",".join(str(id) for id in ids)} status:any',
+        'limit': len(ids),
+        'only': post_fields(context)
+    }
+    async with rate_limited_get(context, context.urls.base_url + context.urls.search_result_endpoint, params=params, auth=context.authenticator) as resp:
+        resp.raise_for_status()
+        return await read_json(context, resp)
 
-async def get_all_error_posts(context:Context)-> list[dict]:
+async def get_all_error_posts(context:Context) -> AsyncIterator[list[dict]]:
     error_ids = context.database.get_error_ids()
     if len(error_ids) == 0:
-        return []
-    posts = []
-    end = 0
-    for id in error_ids:
-        start = time()
-        async with context.session.get(context.urls.base_url + context.urls.specific_post_endpoint.format(id), auth=context.authenticator) as resp:
-            resp.raise_for_status()
-            posts.append(await resp.json())
-        if len(posts) > 100: # Make use of burst pool
-            await asyncio.sleep(max(0, context.rate_limit_interval - (time() - start))) # 1 request per second
-    return posts
-
-async def get_all_new_posts(context: Context, latest_id: int = 0, ) -> list[dict]:
-    page = 1
-    final_result = []
-    end = 0
+        return
+    batches = [error_ids[i:i + RETRY_BATCH_SIZE] for i in range(0, len(error_ids), RETRY_BATCH_SIZE)]
+    found_ids = set()
+    tasks = [asyncio.create_task(get_error_posts_batch(context, batch)) for batch in batches]
+    try:
+        for next_batch in asyncio.as_completed(tasks):
+            posts = await next_batch
+            found_ids.update(post['id'] for post in posts)
+            yield posts
+    finally:
+        for task in tasks: # don't leave batches running when a batch failed or the consumer stopped early
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    missing_ids = [id for id in error_ids if id not in found_ids]
+    if missing_ids:
+        print(f"{len(missing_ids)} IDs are no longer returned by Danbooru and won't be retried: {', '.join(str(id) for id in missing_ids)}")
+        for id in missing_ids:
+            context.database.remove_from_error(id)
+
+def supports_cursor_paging(tags: str) -> bool:
+    # page=b<id> always walks the posts by descending id, so it can't be used when the query sets its own order
+    return not any(tag.lstrip('-').startswith(CUSTOM_ORDER_TAGS) for tag in tags.split())
+
+async def get_all_new_posts(context: Context, latest_id: int = 0, tags: str | None = None, start_page: int | str = 1,
+                            on_page: Callable[[int | str, int], None] | None = None) -> AsyncIterator[list[dict]]:
+    # on_page gets the next page and the first id of the page before, once the consumer asked for more
+    if tags is None:
+        tags = f'ordfav:{context.environment.account_name}'
+    cursor_paging = supports_cursor_paging(tags)
+    page: int | str = start_page
     while True:
-        start = time()
         params = {
-            'tags': f'ordfav:{context.environment.account_name}',
-            'limit': 20,
-            'page': page
+            'tags': tags,
+            'limit': PAGE_LIMIT,
+            'page': page,
+            'only': post_fields(context)
         }
-        async with context.session.get(context.urls.base_url + context.urls.search_result_endpoint, params=params, auth=context.authenticator) as resp:
+        async with rate_limited_get(context, context.urls.base_url + context.urls.search_result_endpoint, params=params, auth=context.authenticator) as resp:
             resp.raise_for_status()
-            result = await resp.json()
+            result = await read_json(context, resp)
 
         if result == []:
-            break
+            return
         result_ids = [item['id'] for item in result]
-        if latest_id in result_ids:
-            stop_index = result_ids.index(latest_id)
-            final_result.extend(result[:stop_index])
-            break
-        final_result.extend(result)
-        page += 1
-        if page > 100: # Make use of burst pool
-            await asyncio.sleep(max(0, context.rate_limit_interval - (time() - start))) # Max 1 request per second
-    return final_result
-        
-async def select_posts(context:Context)->list[dict]:
+        if cursor_paging:
+            stop_index = next((i for i, id in enumerate(result_ids) if id <= latest_id), None)
+        else:
+            stop_index = result_ids.index(latest_id) if latest_id in result_ids else None
+        if stop_index is not None:
+            if stop_index > 0:
+                yield result[:stop_index]
+                if on_page is not None:
+                    on_page(page, result_ids[0])
+            return
+        yield result
+        page = f'b{result_ids[-1]}' if cursor_paging else page + 1
+        if on_page is not None:
+            on_page(page, result_ids[0])
+
+def favourites_source(account_name: str) -> Source:
+    return Source(f'favourites:{account_name}', f'ordfav:{account_name}')
+
+def parse_sources(value: str, account_name: str) -> list[Source]:
+    sources = []
+    for entry in value.split(';'):
+        entry = entry.strip()
+        if entry == '':
+            continue
+        kind, _, argument = entry.partition(':')
+        kind, argument = kind.strip().lower(), argument.strip()
+        if kind not in SOURCE_KINDS or argument == '':
+            raise SystemExit(f"Unknown source '{entry}' in SOURCES, use favourites:<user>, tags:<query> or pool:<id>")
+        if kind == 'favourites':
+            if argument == account_name:
+                source = favourites_source(account_name) # keeps the checkpoint of earlier single-account runs
+            else:
+                source = Source(f'{kind}:{argument}', f'ordfav:{argument}', f'{kind}:{argument}')
+        elif kind == 'tags':
+            source = Source(f'{kind}:{argument}', argument, f'{kind}:{argument}')
+        else:
+            if not argument.isdigit():
+                raise SystemExit(f"Pool source '{entry}' needs the numeric pool id")
+            source = Source(f'{kind}:{argument}', f'pool:{argument}', f'{kind}:{argument}') # pool: lists by id, ordpool: can't be checkpointed
+        if source not in sources:
+            sources.append(source)
+    return sources or [favourites_source(account_name)]
+
+def save_listing_progress(context: Context, source: Source, newest_id: int | None = None) -> Callable[[int | str, int], None]:
+    # called once every post of a page is in run_queue, so a page is never skipped when the run is resumed
+    def save(page: int | str, first_id: int):
+        nonlocal newest_id
+        if newest_id is None:
+            newest_id = first_id
+        context.database.set_run_state(newest_id, page, source.checkpoint)
+    return save
+
+async def resume_listing(context: Context, source: Source, watermark: int, run_newest: int, page: int | str) -> AsyncIterator[list[dict]]:
+    # first what was added since the run was interrupted, then the rest of the interrupted listing
+    newer_id = None
+    async for result in get_all_new_posts(context, run_newest, source.tags):
+        newer_id = newer_id or result[0]['id']
+        yield result
+    if newer_id is not None:
+        context.database.set_run_state(newer_id, page, source.checkpoint)
+    async for result in get_all_new_posts(context, watermark, source.tags, page, save_listing_progress(context, source, newer_id or run_newest)):
+        yield result
+
+async def select_posts(context:Context, source: Source | None = None) -> AsyncIterator[list[PostRecord]]:
+    source = source or favourites_source(context.environment.account_name)
     if context.mode is DownloadMode.NORMAL:
-        return await get_all_new_posts(context, context.database.get_newest_downloaded_id())
+        watermark = context.database.get_newest_downloaded_id(source.checkpoint)
+        run_state = context.database.get_run_state(source.checkpoint)
+        if run_state is None:
+            pages = get_all_new_posts(context, watermark, source.tags, on_page=save_listing_progress(context, source))
+        else:
+            print(f"Continuing the interrupted listing of {source.name}")
+            run_newest, page = run_state
+            pages = resume_listing(context, source, watermark, run_newest, int(page) if page.isdigit() else page)
     elif context.mode is DownloadMode.RETRY:
         print("Gathering IDs of posts that failed to download before")
-        return await get_all_error_posts(context)
-    else: # DownloadMode.FORCE
-        return await get_all_new_posts(context)
-
-
-
-def build_metadata(post: dict) -> PostMetaData:
-    pmd = PostMetaData(post['id'])
-    pmd.md5 = post['md5']
-    pmd.tag_string_general = post['tag_string_general']
-    pmd.tag_string_character = post['tag_string_character']
-    pmd.tag_string_copyright = post['tag_string_copyright']
-    pmd.tag_string_artist = post['tag_string_artist']
-    pmd.tag_string_meta = post['tag_string_meta']
-    pmd.rating = post['rating']
-    pmd.parent_id = post['parent_id']
-    pmd.has_children = bool(post.get('has_children'))
-    pmd.has_active_children = bool(post.get('has_active_children'))
-    pmd.file_ext = post['file_ext']
+        pages = get_all_error_posts(context)
+    else: # DownloadMode.FORCE, DownloadMode.RECONCILE
+        pages = get_all_new_posts(context, tags=source.tags)
+    while True:
+        with context.metrics.time('list'):
+            page = await anext(pages, None)
+        if page is None:
+            return
+        yield [PostRecord.from_json(post, context.variant_policy) for post in page] # the JSON of a page is dropped as soon as it was read
+
+
+
+def build_metadata(post: PostRecord) -> PostMetaData:
+    pmd = PostMetaData(post.id)
+    pmd.md5 = post.md5
+    pmd.tag_string_general = post.tag_string_general
+    pmd.tag_string_character = post.tag_string_character
+    pmd.tag_string_copyright = post.tag_string_copyright
+    pmd.tag_string_artist = post.tag_string_artist
+    pmd.tag_string_meta = post.tag_string_meta
+    pmd.rating = post.rating
+    pmd.parent_id = post.parent_id
+    pmd.has_children = post.has_children
+    pmd.has_active_children = post.has_active_children
+    pmd.file_ext = post.file_ext
+    pmd.variant = post.variant
     return pmd
 
-async def download_limiter(context: Context, post_json: dict):
-    async with context.semaphore:
-        return await download_file(context, post_json)
+async def download_limiter(context: Context, post: PostRecord) -> DownloadResult:
+    with context.metrics.time('local_copy'):
+        local_copy = await find_local_copy(context, post)
+    if local_copy is not None:
+        context.metrics.count('reused_files')
+        return local_copy
+    retries = context.environment.download_retries
+    for attempt in range(retries + 1):
+        async with context.concurrency.slot() as sample:
+            with context.metrics.time('download'):
+                result = await download_file(context, post)
+            sample.status, sample.size = result.status, result.size
+        context.metrics.count('downloaded_bytes', result.size)
+        if result.success or not is_transient_failure(result.status) or attempt == retries:
+            return result
+        # wait outside the slot so other downloads keep going, the .part file lets the next attempt resume
+        delay = backoff_delay(attempt)
+        context.metrics.count('download_retries')
+        print(f"[RETRY] Post {post.id} failed with status {result.status}, attempt {attempt + 2}/{retries + 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    return result
+
+def is_transient_failure(status: int | None) -> bool:
+    # 0 means the connection failed or timed out before the file was complete
+    return status == 0 or status == 408 or status == 429 or (status is not None and status >= 500)
+
+def backoff_delay(attempt: int) -> float:
+    # exponential backoff with full jitter, so failed downloads don't all come back at the same moment
+    return random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+async def produce_posts(context: Context, queue: asyncio.Queue, workers: int) -> dict[Source | None, tuple[int | None, bool]]:
+    # One producer per source, the queue hands out free slots in the order producers wait for them,
+    # so every source gets its turn instead of the first one being downloaded completely
+    sources: list[Source | None] = [None] if context.mode is DownloadMode.RETRY or not context.sources else list(context.sources)
+    try:
+        if context.mode is DownloadMode.NORMAL:
+            await produce_queued_posts(context, queue)
+        progress = await asyncio.gather(*(produce_source(context, source, queue) for source in sources))
+    finally:
+        for _ in range(workers):
+            await queue.put(None)
+    return dict(zip(sources, progress))
+
+async def produce_queued_posts(context: Context, queue: asyncio.Queue):
+    # posts an interrupted run had listed but not finished
+    ids = context.database.get_queued_ids()
+    if not ids:
+        return
+    print(f"Continuing with {len(ids)} posts left over from the interrupted run")
+    found = set()
+    try:
+        for start in range(0, len(ids), RETRY_BATCH_SIZE):
+            for post_json in await get_error_posts_batch(context, ids[start:start + RETRY_BATCH_SIZE]):
+                post = PostRecord.from_json(post_json, context.variant_policy)
+                if context.stopping.is_set():
+                    return
+                found.add(post.id)
+                context.seen_ids.add(post.id)
+                await queue.put(post)
+    except Exception as e:
+        print(f"[EXCEPTION] Listing the posts left over from the interrupted run failed with error: {e}")
+        return
+    for id in ids:
+        if id not in found: # no longer returned by Danbooru
+            context.database.settle_post(id)
+
+async def produce_source(context: Context, source: Source | None, queue: asyncio.Queue) -> tuple[int | None, bool]:
+    newest_id = None
+    listing_complete = False
+    try:
+        async with aclosing(select_posts(context, source)) as pages:
+            async for page in pages:
+                if newest_id is None and page:
+                    newest_id = page[0].id
+                if context.listed_ids is not None:
+                    context.listed_ids.update(post.id for post in page)
+                new_posts = [post for post in page if post.id not in context.seen_ids] # others were queued by another source
+                context.seen_ids.update(post.id for post in new_posts)
+                if context.mode is DownloadMode.NORMAL:
+                    context.database.queue_posts([post.id for post in new_posts])
+                for post in new_posts:
+                    if context.stopping.is_set():
+                        return newest_id, False # the rest stays in run_queue for the next run
+                    await queue.put(post) # blocks while the workers are busy, keeping memory flat
+                context.metrics.sample_queue('posts', queue.qsize())
+        listing_complete = True
+    except Exception as e:
+        name = f" of {source.name}" if source is not None else ""
+        print(f"[EXCEPTION] Listing posts{name} failed with error: {e}")
+    return newest_id, listing_complete
+
+async def record_failure(context: Context, post: PostRecord, error: Exception) -> tuple[int, int]:
+    # Last resort for unexpected errors, a single post must never take down a worker
+    print(f"[EXCEPTION] Processing post with ID {post.id} failed with error: {error}")
+    try:
+        return await handle_result(context, DownloadResult(False, post))
+    except Exception as e:
+        print(f"[EXCEPTION] Recording the failure of post with ID {post.id} failed with error: {e}")
+        return 0, 1
 
-async def download_file(context: Context, post_json: dict) -> tuple[bool, dict]:
-    file_url = post_json.get('file_url', '')
+async def download_worker(context: Context, queue: asyncio.Queue, conversions: asyncio.Queue, bar) -> tuple[int, int]:
+    success, errors = 0, 0
+    while (post := await queue.get()) is not None:
+        if context.stopping.is_set():
+            continue # left in run_queue, the next run picks it up
+        try:
+            if context.mode is DownloadMode.RECONCILE and await is_post_intact(context, post):
+                bar()
+                continue
+            result = await download_limiter(context, post)
+            if result.success:
+                with context.metrics.time('md5_check'):
+                    md5_matches = await md5_check(context, result)
+                if not md5_matches:
+                    result = result._replace(success=False)
+            if result.success and result.post.file_ext == 'zip' and context.environment.convert_ugoira_to_webp:
+                await conversions.put(result) # bookkeeping happens once the conversion is done
+                context.metrics.sample_queue('conversions', conversions.qsize())
+                continue
+            s, e = await finish_download(context, result)
+        except Exception as ex:
+            s, e = await record_failure(context, post, ex)
+        success += s
+        errors += e
+        bar()
+    return success, errors
+
+def layout_file_path(layout: str, post_id: int, file_ext: str, md5: str = '') -> str:
+    # relative to FILE_DIRECTORY, the sharded layouts keep a few thousand files per directory at most
+    file_name = f'Danbooru_{str(post_id)}.{file_ext}'
+    if layout == 'id':
+        return os.path.join(f'{post_id // ID_SHARD_SIZE:05d}', file_name)
+    if layout == 'md5' and md5 != '':
+        return os.path.join(md5[:2], md5[2:4], file_name)
+    return file_name
+
+def library_file_path(file_directory: str, post_id: int, file_ext: str, stored_path: str | None = None) -> str:
+    # where a recorded post is, files downloaded before paths were recorded are in the flat layout
+    return os.path.join(file_directory, stored_path or layout_file_path('flat', post_id, file_ext))
+
+def post_file_path(context: Context, post_id: int, file_ext: str, md5: str = '') -> str:
+    # where a new download goes
+    return os.path.join(context.environment.file_directory, layout_file_path(context.environment.file_layout, post_id, file_ext, md5))
+
+def hash_file(path: str, chunk_size: int = CHUNK_SIZE):
+    file_hash = md5()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash
+
+async def local_file_md5(context: Context, path: str) -> str | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    cached = context.database.get_cached_md5(path, stat.st_size, stat.st_mtime_ns)
+    if cached is not None:
+        return cached
+    digest = (await asyncio.to_thread(hash_file, path, VERIFY_CHUNK_SIZE)).hexdigest()
+    context.database.cache_md5(path, stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+async def download_file(context: Context, post: PostRecord) -> DownloadResult:
+    import aiohttp
+    file_url = post.file_url
     if file_url == '':
-        print(f"No file url found for post id {post_json['id']}")
-        return (False, post_json)
-    file_ext = post_json.get('file_ext', '')
+        print(f"No file url found for post id {post.id}")
+        return DownloadResult(False, post)
+    file_ext = post.file_ext
     if file_ext == '':
-        print(f"No original variant found for post id {post_json['id']}")
-        return (False, post_json)
+        print(f"No original variant found for post id {post.id}")
+        return DownloadResult(False, post)
+    complete_path = post_file_path(context, post.id, file_ext, post.md5)
+    partial_path = complete_path + PARTIAL_SUFFIX
+    os.makedirs(os.path.dirname(complete_path), exist_ok=True)
+    file_hash = md5()
+    headers = {}
+    if os.path.exists(partial_path) and os.path.getsize(partial_path) > 0:
+        # keep what an earlier attempt already fetched and ask only for the rest
+        file_hash = await asyncio.to_thread(hash_file, partial_path)
+        headers['Range'] = f'bytes={os.path.getsize(partial_path)}-'
+    status, size = 0, 0
     try:
-        async with context.session.get(file_url) as resp:
+        async with rate_limited_get(context, file_url, headers=headers) as resp:
+            status = resp.status
+            if resp.status == 416 and headers: # nothing left to fetch, md5_check decides if the partial file is good
+                return DownloadResult(True, post, file_hash.hexdigest(), status, path=complete_path)
             resp.raise_for_status()
-            file_name = f"Danbooru_{str(post_json['id'])}.{file_ext}"
-            complete_path = os.path.join(context.environment.file_directory, file_name)
+            file_mode = "ab"
+            if resp.status != 206: # server ignored the range, start over
+                file_hash = md5()
+                file_mode = "wb"
 
-            with open(complete_path, "wb") as f:
-                async for chunk in resp.content.iter_chunked(8192):
+            with open(partial_path, file_mode) as f:
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    file_hash.update(chunk)
                     f.write(chunk)
+                    size += len(chunk)
+    except aiohttp.ClientResponseError as e:
+        print(f"[EXCEPTION] Download failed with error: {e}")
+        return DownloadResult(False, post, status=status, size=size)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[EXCEPTION] Download failed with error: {e!r}")
+        return DownloadResult(False, post, status=0, size=size)
     except Exception as e:
         print(f"[EXCEPTION] Download failed with error: {e}")
-        return (False, post_json)
-    return (True, post_json)
-
-
-async def md5_check(context:Context, ret:tuple[bool, dict]) -> bool:
-    _, post_json = ret
-    file_name:str =f'Danbooru_{str(post_json['id'])}'
-    file_ext:str = post_json['file_ext']
-    path_to_file:str = os.path.join(context.environment.file_directory, f'{file_name}.{file_ext}')
-    md5_result = md5(open(path_to_file,'rb').read()).hexdigest()
-    retVal:bool = post_json['md5'] == md5_result
-    if not retVal:
-        os.remove(path_to_file)
+        return DownloadResult(False, post, status=status, size=size)
+    return DownloadResult(True, post, file_hash.hexdigest(), status, size, complete_path)
+
+
+async def is_post_intact(context: Context, post: PostRecord) -> bool:
+    # recorded in the database and the file on disk still has the recorded md5
+    recorded = context.database.get_post(post.id)
+    if recorded is None:
+        return False
+    recorded_md5, file_ext, stored_path = recorded
+    return await local_file_md5(context, library_file_path(context.environment.file_directory, post.id, file_ext, stored_path)) == recorded_md5
+
+def place_local_copy(source: str, partial_path: str, complete_path: str):
+    os.makedirs(os.path.dirname(complete_path), exist_ok=True)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    if source != complete_path:
+        try:
+            os.link(source, partial_path)
+        except OSError: # other file system or no hard link support
+            shutil.copyfile(source, partial_path)
+        os.replace(partial_path, complete_path)
+
+async def find_local_copy(context: Context, post: PostRecord) -> DownloadResult | None:
+    # Reuses an identical file that is already on disk, either this post's own file or another post with the same md5
+    expected_md5 = post.md5
+    file_ext = post.file_ext
+    if expected_md5 == '' or file_ext == '' or post.variant != 'original':
+        return None # only the original has a known md5
+    if file_ext == 'zip' and context.environment.convert_ugoira_to_webp:
+        return None # the zip isn't kept, and the stored md5 of the webp can't be compared to the api md5
+    complete_path = post_file_path(context, post.id, file_ext, expected_md5)
+    file_directory = context.environment.file_directory
+    candidates = [complete_path] + [library_file_path(file_directory, id, ext, stored_path) for id, ext, stored_path in context.database.get_posts_by_md5(expected_md5)]
+    for candidate in dict.fromkeys(candidates):
+        if await local_file_md5(context, candidate) == expected_md5:
+            await asyncio.to_thread(place_local_copy, candidate, complete_path + PARTIAL_SUFFIX, complete_path)
+            return DownloadResult(True, post, expected_md5, path=complete_path)
+    return None
+
+async def md5_check(context:Context, ret:DownloadResult) -> bool:
+    post = ret.post
+    complete_path = ret.path
+    partial_path = complete_path + PARTIAL_SUFFIX
+    retVal:bool = post.md5 == ret.md5
+    if post.variant != 'original':
+        retVal = ret.md5 != '' # the API md5 is the original's, a cut off transfer already failed in download_file
+    if not os.path.exists(partial_path):
+        return retVal # find_local_copy already put the file in place
+    if retVal:
+        os.replace(partial_path, complete_path)
+    else:
+        os.remove(partial_path)
     return retVal
 
-async def handle_result(context:Context, ret:tuple[bool, dict]):
+async def finish_download(context: Context, result: DownloadResult) -> tuple[int, int]:
+    with context.metrics.time('handle_result'):
+        s,e = await handle_result(context, result)
+    if result.success:
+        print(f"Finished downloading post with ID {result.post.id}")
+    else:
+        print(f"There was an issue downloading post with ID {result.post.id}")
+    return s, e
+
+async def handle_result(context:Context, ret:DownloadResult):
     success, errors = 0, 0
-    donwload_successful, post_json = ret
-    post_id = post_json['id']
+    donwload_successful, post = ret.success, ret.post
+    post_id = post.id
     if donwload_successful:
-        context.database.insert_post_data(build_metadata(post_json))
+        metadata = build_metadata(post)
+        if ret.md5 not in ('', post.md5):
+            # converted ugoira and variants, verify and reconcile check the file's own hash, the md5 layout uses the API one
+            metadata.md5, metadata.api_md5 = ret.md5, post.md5
+        if ret.path != '':
+            metadata.file_path = os.path.relpath(ret.path, context.environment.file_directory)
+        context.database.insert_post_data(metadata)
         if context.mode is DownloadMode.RETRY:
             context.database.remove_from_error(post_id)
         success += 1
     elif context.mode is not DownloadMode.RETRY:
         context.database.insert_id_to_error(post_id)
         errors += 1
+    context.database.settle_post(post_id)
     return success, errors
 
-async def convert_ugoira_to_webp(context:Context, ret:tuple[bool, dict]) -> None:
-    _, post_json = ret
-    file_name:str =f'Danbooru_{str(post_json['id'])}'
-    
-    path_to_zip:str = os.path.join(context.environment.file_directory, f'{file_name}.zip')
-    if path_to_zip.startswith('.'):
-        path_to_zip = os.getcwd() + path_to_zip[1:]
-    output_file:str = os.path.join(context.environment.file_directory, f'{file_name}.webp')
-    frames:list[Image.Image] = []
-    durations:list[int] | int = []
-    frame_files:list[str] = []
-
-    with zipfile.ZipFile(path_to_zip) as zip: # needs absolute path
-        meta_file = next((f for f in zip.namelist() if f.endswith(".json")), None)
-        
-        if meta_file:
-            meta = json.loads(zip.read(meta_file))
-            frame_files = [f['file'] for f in meta['frames']]
-            durations = [f['delay'] for f in meta['frames']]
-        else:
-            frame_files = sorted(
-                f for f in zip.namelist()
-                if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-            )
-            durations = int(post_json['media_asset'].get('duration', len(frame_files)) * 1000 / len(frame_files))
-
-        for f in frame_files:
-            img:Image.Image = Image.open(io.BytesIO(zip.read(f)))
-            frames.append(img.convert('RGBA'))
-
-    frames[0].save(
-        output_file,
-        save_all=True,
-        append_images=frames[1:],
-        duration=durations,
-        loop=0,
-        format='WEBP',
-        lossless=True
-    )
-    os.remove(path_to_zip)
+async def convert_ugoira_to_webp(context:Context, ret:DownloadResult) -> str:
+    from .ugoira import convert_ugoira # loads Pillow, only needed once an ugoira shows up
+    post = ret.post
+    path_to_zip:str = os.path.abspath(ret.path) # the conversion process may not share the working directory
+    output_file:str = converted_file_path(ret.path)
+    duration = post.duration
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(context.conversion_pool, convert_ugoira, path_to_zip, output_file + PARTIAL_SUFFIX, output_file, duration)
+
+def converted_file_path(path_to_zip: str) -> str:
+    return os.path.splitext(path_to_zip)[0] + '.webp'
+
+async def conversion_worker(context: Context, queue: asyncio.Queue, bar) -> tuple[int, int]:
+    success, errors = 0, 0
+    while (result := await queue.get()) is not None:
+        try:
+            with context.metrics.time('convert'):
+                webp_md5 = await convert_ugoira_to_webp(context, result)
+            result.post.file_ext = 'webp'
+            result = result._replace(md5=webp_md5, path=converted_file_path(result.path))
+        except Exception as e:
+            print(f"[EXCEPTION] Converting ugoira failed with error: {e}")
+            result = result._replace(success=False)
+        try:
+            s, e = await finish_download(context, result)
+        except Exception as ex:
+            s, e = await record_failure(context, result.post, ex)
+        success += s
+        errors += e
+        bar()
+    return success, errors
+
+def load_environment() -> Environment:
+    from dotenv import load_dotenv
+    load_dotenv()
+    return Environment(os.getenv('ACCOUNT_NAME') or '',
+                       os.getenv('API_KEY') or '',
+                       os.getenv('DB_LOCATION') or '',
+                       os.getenv('FILE_DIRECTORY') or '',
+                       (os.getenv('CONVERT_UGOIRA_TO_WEBP') or 'False') == 'True',
+                       float(os.getenv('RATE_LIMIT') or 10),
+                       int(os.getenv('RATE_LIMIT_BURST') or 100),
+                       int(os.getenv('UGOIRA_WORKERS') or DEFAULT_CONVERSION_WORKERS),
+                       int(os.getenv('MAX_DOWNLOADS') or 16),
+                       int(os.getenv('DOWNLOAD_RETRIES') or 3),
+                       os.getenv('METRICS_FILE') or '',
+                       os.getenv('PROMETHEUS_TEXTFILE') or '',
+                       (os.getenv('BASE_URL') or 'https://danbooru.donmai.us').rstrip('/'),
+                       (os.getenv('FILE_LAYOUT') or 'flat').lower(),
+                       float(os.getenv('WATCH_INTERVAL') or 60),
+                       os.getenv('SOURCES') or '',
+                       os.getenv('FILE_VARIANT') or 'original')
 
 def validate_environment_variables(env:Environment):
     if env.file_directory == '' or env.account_name == '' or env.api_key == '':
@@ -218,9 +745,26 @@ def validate_environment_variables(env:Environment):
         if env.api_key == '': print("API_KEY")
         if env.file_directory == '': print("FILE_DIRECTORY")
         sys_exit(0)
+    if env.rate_limit <= 0 or env.rate_limit_burst < 1:
+        raise SystemExit("RATE_LIMIT must be greater than 0 and RATE_LIMIT_BURST at least 1")
+    if env.max_downloads < 1:
+        raise SystemExit("MAX_DOWNLOADS must be at least 1")
+    if env.download_retries < 0:
+        raise SystemExit("DOWNLOAD_RETRIES must not be negative")
+    if env.file_layout not in FILE_LAYOUTS:
+        raise SystemExit(f"FILE_LAYOUT must be one of {', '.join(FILE_LAYOUTS)}")
+    if env.watch_interval <= 0:
+        raise SystemExit("WATCH_INTERVAL must be greater than 0")
+    parse_sources(env.sources, env.account_name) # exits on a malformed entry
+    parse_variant_policy(env.file_variant)
     if env.db_location == '':
         env.db_location = os.getcwd()
         print("DB_LOCATION was missing, using cwd instead")
+    if env.metrics_file == '':
+        env.metrics_file = os.path.join(env.db_location, "run-metrics.json")
+    if not 1 <= env.conversion_workers <= MAX_CONVERSION_WORKERS:
+        env.conversion_workers = min(max(env.conversion_workers, 1), MAX_CONVERSION_WORKERS)
+        print(f"UGOIRA_WORKERS must be between 1 and {MAX_CONVERSION_WORKERS}, using {env.conversion_workers} instead")
     
     if not os.path.exists(env.db_location):
         os.makedirs(env.db_location)
@@ -229,90 +773,299 @@ def validate_environment_variables(env:Environment):
 
 
 async def a_main(mode: DownloadMode):
-    env: Environment = Environment(os.getenv('ACCOUNT_NAME') or '',
-                                   os.getenv('API_KEY') or '',
-                                   os.getenv('DB_LOCATION') or '',
-                                   os.getenv('FILE_DIRECTORY') or '',
-                                   (os.getenv('CONVERT_UGOIRA_TO_WEBP') or 'False') == 'True')
+    import aiohttp
+    env: Environment = load_environment()
     validate_environment_variables(env)
 
     with Database(os.path.join(env.db_location, "post-downloads.db")) as database:        
-        async with aiohttp.ClientSession() as session:
+        connector = aiohttp.TCPConnector(limit=env.max_downloads + API_CONNECTIONS,
+                                         ttl_dns_cache=DNS_CACHE_SECONDS,
+                                         keepalive_timeout=KEEPALIVE_SECONDS)
+        async with aiohttp.ClientSession(connector=connector) as session:
             authenticator = aiohttp.BasicAuth(login=env.account_name, password=env.api_key)
-            urls:Urls = Urls('https://danbooru.donmai.us', '/posts.json', '/posts/{0}.json')
-            context:Context = Context(env, database, session, mode, authenticator, urls, 1.0, asyncio.Semaphore(10))
-
-            if context.mode is DownloadMode.FORCE:
-                database.delete_tables()
-                database.create_tables()
-            database.commit()
-
-            posts = await select_posts(context)
-
-            post_ids = [p['id'] for p in posts]
-            if not post_ids:
-                if mode is DownloadMode.RETRY: print("No post marked as a failed download")
-                else: print("No new IDs found")
-                return
-            print(f"{str(len(post_ids))} new IDs found")
-
-            total_success = total_errors = 0
-            newest_id = post_ids[0]
-
-            tasks = [asyncio.create_task(download_limiter(context, post)) for post in posts]
-
-            with alive_bar(len(tasks), title="Downloading posts") as bar:
-                for completed_task in asyncio.as_completed(tasks):
-                    result = await completed_task
-                    
-                    was_md5_check_successful = await md5_check(context, result)
-                    if not was_md5_check_successful:
-                        result = (False, result[1])
-                    if result[0] and result[1]['file_ext'] == 'zip' and context.environment.convert_ugoira_to_webp:
-                        result[1]['file_ext'] = 'webp'
-                        await convert_ugoira_to_webp(context, result)
-                        file_name:str =f'Danbooru_{str(result[1]['id'])}'
-                        path_to_file:str = os.path.join(context.environment.file_directory, f'{file_name}.webp')
-                        md5_result = md5(open(path_to_file,'rb').read()).hexdigest()
-                        result[1]['md5'] = md5_result
-                    s,e = await handle_result(context, result)
-                    if result[0]:
-                        print(f"Finished downloading post with ID {result[1]['id']}")
-                    else:
-                        print(f"There was an issue downloading post with ID {result[1]['id']}")
-                    total_success += s
-                    total_errors += e
-                    bar()
-
-        if total_errors > 0: print(f"Failed to download {total_errors} IDs!")
-        if total_success > 0: print(f"Successfully downloaded {total_success} IDs!")
-        if mode is not DownloadMode.RETRY:
-            database.set_newest_downloaded_id(newest_id)
-        database.commit()
+            urls:Urls = Urls(env.base_url, '/posts.json')
+            rate_limiter = RateLimiter(env.rate_limit, env.rate_limit_burst)
+            concurrency = ConcurrencyController(initial=min(INITIAL_DOWNLOADS, env.max_downloads), maximum=env.max_downloads)
+            context:Context = Context(env, database, session, mode, authenticator, urls, rate_limiter, concurrency)
+            context.sources = parse_sources(env.sources, env.account_name)
+            context.variant_policy = parse_variant_policy(env.file_variant)
+            if env.convert_ugoira_to_webp:
+                from concurrent.futures import ProcessPoolExecutor
+                import multiprocessing
+                # spawn so the workers don't inherit the running event loop and the progress bar thread
+                context.conversion_pool = ProcessPoolExecutor(max_workers=env.conversion_workers, mp_context=multiprocessing.get_context("spawn"))
+            watch_signals(context)
+            try:
+                if mode is DownloadMode.WATCH:
+                    await watch(context)
+                else:
+                    await run_pipeline(context)
+            finally:
+                if context.conversion_pool is not None:
+                    context.conversion_pool.shutdown()
     print("Done")
-    sleep(2)
+
+def watch_signals(context: Context):
+    # The first SIGINT/SIGTERM lets the downloads in progress finish and flushes the database,
+    # a second one cancels right away. Windows has no loop signal handlers, Ctrl+C cancels there.
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    def request_stop():
+        if context.stopping.is_set():
+            if main_task is not None:
+                main_task.cancel()
+            return
+        print("\nStopping once the downloads in progress are done, press Ctrl+C again to quit right away")
+        context.stopping.set()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+async def run_pipeline(context: Context):
+    from alive_progress import alive_bar
+    database, env, mode = context.database, context.environment, context.mode
+    if mode is DownloadMode.FORCE:
+        database.delete_tables()
+        database.create_tables()
+    elif mode is DownloadMode.RECONCILE:
+        context.listed_ids = set()
+    database.commit()
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    conversions: asyncio.Queue = asyncio.Queue(maxsize=env.conversion_workers * 2)
+    with alive_bar(None, title="Downloading posts") as bar:
+        converters = []
+        if env.convert_ugoira_to_webp:
+            converters = [asyncio.create_task(conversion_worker(context, conversions, bar)) for _ in range(env.conversion_workers)]
+        workers = [asyncio.create_task(download_worker(context, queue, conversions, bar)) for _ in range(env.max_downloads)]
+        progress = await produce_posts(context, queue, len(workers))
+        results = await asyncio.gather(*workers)
+        for _ in converters:
+            await conversions.put(None)
+        results += await asyncio.gather(*converters)
+
+    total_success = sum(s for s, _ in results)
+    total_errors = sum(e for _, e in results)
+    write_metrics(context, total_success, total_errors)
+    listing_complete = all(complete for _, complete in progress.values())
+    if not context.stopping.is_set():
+        advance_watermarks(context, progress)
+    database.commit()
+    if context.stopping.is_set():
+        print("Stopped before the run was finished, the next run continues where this one stopped")
+    if all(newest_id is None for newest_id, _ in progress.values()):
+        if mode is DownloadMode.RETRY: print("No post marked as a failed download")
+        elif listing_complete: print("No new IDs found")
+        return
+
+    if total_errors > 0: print(f"Failed to download {total_errors} IDs!")
+    print(f"Ran up to {context.concurrency.peak_limit} downloads in parallel, finished with a limit of {context.concurrency.limit}")
+    if total_success > 0: print(f"Successfully downloaded {total_success} IDs!")
+    if context.rate_limiter.total_wait > 0:
+        print(f"Waited {context.rate_limiter.total_wait:.1f}s on the rate limiter over {context.rate_limiter.requests} requests ({context.rate_limiter.throttled} throttled by the server)")
+    if context.listed_ids is not None and listing_complete:
+        unlisted = len(database.get_post_ids() - context.listed_ids)
+        if unlisted > 0: print(f"{unlisted} downloaded posts are no longer in your favourites, they were left untouched")
+
+def advance_watermarks(context: Context, progress: dict[Source | None, tuple[int | None, bool]]):
+    # Only for completely listed sources, once the workers are done every post of them is settled
+    if context.mode is DownloadMode.RETRY:
+        return
+    for source, (newest_id, complete) in progress.items():
+        if not complete:
+            continue
+        checkpoint = source.checkpoint if source else ''
+        if context.mode is DownloadMode.NORMAL:
+            context.database.finish_run(checkpoint) # newest id recorded while listing
+        elif newest_id is not None:
+            context.database.set_newest_downloaded_id(newest_id, checkpoint)
+
+async def get_newest_listed_id(context: Context, source: Source) -> int | None:
+    params = {'tags': source.tags, 'limit': 1, 'only': 'id'}
+    async with rate_limited_get(context, context.urls.base_url + context.urls.search_result_endpoint, params=params, auth=context.authenticator) as resp:
+        resp.raise_for_status()
+        result = await read_json(context, resp)
+    return result[0]['id'] if result else None
+
+async def has_new_posts(context: Context) -> bool:
+    for source in context.sources or [favourites_source(context.environment.account_name)]:
+        newest_id = await get_newest_listed_id(context, source)
+        if newest_id is not None and newest_id != context.database.get_newest_downloaded_id(source.checkpoint):
+            return True
+    return False
+
+async def watch(context: Context):
+    # Stays resident and reuses the session and database, polling costs one tiny request per source
+    context.mode = DownloadMode.NORMAL
+    interval = context.environment.watch_interval
+    print(f"Watching for new posts every {interval:g}s, stop with Ctrl+C")
+    check = False # the first round catches up with everything added since the last run
+    while not context.stopping.is_set():
+        try:
+            if not check or await has_new_posts(context):
+                context.metrics = Metrics()
+                context.rate_limiter.reset_counters()
+                context.seen_ids = set()
+                await run_pipeline(context)
+            check = True
+        except Exception as e:
+            print(f"[EXCEPTION] Checking for new posts failed with error: {e}")
+        try:
+            await asyncio.wait_for(context.stopping.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+def write_metrics(context: Context, total_success: int, total_errors: int):
+    metrics = context.metrics
+    metrics.count('posts_downloaded', total_success)
+    metrics.count('posts_failed', total_errors)
+    metrics.count('throttled_requests', context.rate_limiter.throttled)
+    metrics.count('rate_limiter_wait_seconds', context.rate_limiter.total_wait)
+    metrics.set_gauge('concurrency_peak', context.concurrency.peak_limit)
+    metrics.set_gauge('concurrency_final', context.concurrency.limit)
+    try:
+        metrics.write_json(context.environment.metrics_file)
+        if context.environment.prometheus_textfile != '':
+            metrics.write_prometheus(context.environment.prometheus_textfile)
+    except OSError as e:
+        print(f"[EXCEPTION] Writing the run metrics failed with error: {e}")
 
 def get_mode_from_args() -> DownloadMode:
     if len(sys_argv) > 1 and sys_argv[1] in ("-h", "--help"):
-        print("Usage: danbooru [normal|retry|force]")
+        print("Usage: danbooru [normal|retry|force|reconcile|watch|verify|migrate|search <tags>]")
         sys_exit(0)
 
     mode:DownloadMode = DownloadMode.NORMAL
-    if len(sys_argv) == 2:
+    if len(sys_argv) >= 2:
         arg = sys_argv[1].lower()
         try:
             mode = DownloadMode(arg)
         except ValueError:
             raise SystemExit(
                 f"Unknown mode '{arg}'. "
-                f"Valid modes: normal, retry, force"
+                f"Valid modes: normal, retry, force, reconcile, watch, verify, migrate, search"
             )
+        if len(sys_argv) > 2 and mode is not DownloadMode.SEARCH:
+            raise SystemExit(f"Mode '{arg}' takes no further arguments")
     return mode
 
+def search_library(query: str):
+    env = load_environment()
+    validate_environment_variables(env)
+    with Database(os.path.join(env.db_location, "post-downloads.db")) as database:
+        start = monotonic()
+        results = database.search_posts(query)
+        elapsed = monotonic() - start
+    for post_id, file_ext, stored_path in results:
+        print(library_file_path(env.file_directory, post_id, file_ext, stored_path))
+    print(f"{len(results)} posts found in {elapsed * 1000:.1f}ms", file=sys_stderr)
+
+def hash_for_verify(path: str) -> str | None:
+    try:
+        return hash_file(path, VERIFY_CHUNK_SIZE).hexdigest()
+    except OSError:
+        return None
+
+def verify_library():
+    from alive_progress import alive_bar
+    env = load_environment()
+    validate_environment_variables(env)
+    with Database(os.path.join(env.db_location, "post-downloads.db")) as database:
+        mismatched:list[int] = []
+        to_hash:list[tuple[int, str, str, os.stat_result]] = []
+        for post_id, expected_md5, file_ext, stored_path in database.get_all_posts():
+            path = library_file_path(env.file_directory, post_id, file_ext, stored_path)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                mismatched.append(post_id)
+                continue
+            cached = database.get_cached_md5(path, stat.st_size, stat.st_mtime_ns)
+            if cached is None:
+                to_hash.append((post_id, expected_md5, path, stat))
+            elif cached != expected_md5:
+                mismatched.append(post_id)
+
+        print(f"{len(to_hash)} files changed since they were last verified and need to be hashed")
+        with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool, alive_bar(len(to_hash), title="Verifying files") as bar:
+            for (post_id, expected_md5, path, stat), digest in zip(to_hash, pool.map(hash_for_verify, [item[2] for item in to_hash])):
+                if digest is None:
+                    mismatched.append(post_id)
+                else:
+                    database.cache_md5(path, stat.st_size, stat.st_mtime_ns, digest)
+                    if digest != expected_md5:
+                        mismatched.append(post_id)
+                bar()
+
+        for post_id in mismatched:
+            database.insert_id_to_error(post_id)
+        database.commit()
+    if mismatched:
+        print(f"{len(mismatched)} files are missing or damaged, run retry mode to download them again")
+    else:
+        print("All files match their md5")
+
+def move_library_file(file_directory: str, current: str, target: str) -> bool:
+    # Moves one file into the new layout, safe to repeat after an interruption
+    if not os.path.exists(current):
+        return os.path.exists(target) # moved before the database was updated
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(current, target)
+    directory = os.path.dirname(current)
+    if os.path.abspath(directory) != os.path.abspath(file_directory):
+        try:
+            os.rmdir(directory) # only succeeds once the old shard is empty
+        except OSError:
+            pass
+    return True
+
+def migrate_library():
+    from alive_progress import alive_bar
+    env = load_environment()
+    validate_environment_variables(env)
+    with Database(os.path.join(env.db_location, "post-downloads.db")) as database:
+        moves:list[tuple[int, str, str, str]] = []
+        for post_id, layout_md5, file_ext, stored_path in database.get_post_locations():
+            target = layout_file_path(env.file_layout, post_id, file_ext, layout_md5)
+            if stored_path == target:
+                continue
+            current = library_file_path(env.file_directory, post_id, file_ext, stored_path)
+            moves.append((post_id, current, os.path.join(env.file_directory, target), target))
+
+        print(f"{len(moves)} files need to be moved into the {env.file_layout} layout")
+        missing = 0
+        with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool, alive_bar(len(moves), title="Moving files") as bar:
+            moved = pool.map(lambda move: move_library_file(env.file_directory, move[1], move[2]), moves)
+            for (post_id, current, target_path, target), ok in zip(moves, moved):
+                if ok:
+                    database.set_file_path(post_id, target) # recorded per file, an interrupted migration continues where it stopped
+                    database.move_cached_md5(current, target_path)
+                else:
+                    missing += 1
+                bar()
+        database.commit()
+    if missing:
+        print(f"{missing} files were not found, run verify and retry to download them again")
+    print("Done")
+
 def main(mode:DownloadMode = DownloadMode.NONE):
     if(mode == DownloadMode.NONE):
         mode = get_mode_from_args()
-    asyncio.run(a_main(mode))
+    if mode is DownloadMode.SEARCH:
+        search_library(" ".join(sys_argv[2:]))
+        return
+    if mode is DownloadMode.VERIFY:
+        verify_library()
+        return
+    if mode is DownloadMode.MIGRATE:
+        migrate_library()
+        return
+    try:
+        asyncio.run(a_main(mode))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Stopped") # the database was flushed and closed while unwinding
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,157 @@
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import monotonic
+
+# Upper bounds in seconds, chosen to cover both SQLite writes (milliseconds) and large downloads (minutes)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+PROMETHEUS_PREFIX = 'danbooru'
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[next(i for i, bound in enumerate(BUCKETS) if value <= bound)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket the quantile falls into, capped by the largest value seen
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total_seconds': self.sum,
+            'mean_seconds': self.sum / self.count if self.count else 0.0,
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'p99_seconds': self.quantile(0.99),
+            'max_seconds': self.max,
+            'buckets': {format_bound(bound): count for bound, count in zip(BUCKETS, self.counts)},
+        }
+
+
+class QueueDepth:
+    def __init__(self):
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, depth: int):
+        self.samples += 1
+        self.total += depth
+        self.max = max(self.max, depth)
+
+    def to_dict(self) -> dict:
+        return {'samples': self.samples, 'mean': self.total / self.samples if self.samples else 0.0, 'max': self.max}
+
+
+class Metrics:
+    '''
+    Collects stage timings, transferred bytes, queue depths and request counts of one run.
+    Everything runs on the event loop, so no locking is needed.
+    '''
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.started = monotonic()
+        self.stages: dict[str, Histogram] = {}
+        self.queues: dict[str, QueueDepth] = {}
+        self.requests: dict[int, int] = {} # by HTTP status
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+
+    @contextmanager
+    def time(self, stage: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(stage, Histogram()).observe(monotonic() - start)
+
+    def count(self, name: str, amount: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_request(self, status: int):
+        self.requests[status] = self.requests.get(status, 0) + 1
+
+    def sample_queue(self, name: str, depth: int):
+        self.queues.setdefault(name, QueueDepth()).observe(depth)
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def report(self) -> dict:
+        duration = monotonic() - self.started
+        downloaded = self.counters.get('downloaded_bytes', 0)
+        download_time = self.stages['download'].sum if 'download' in self.stages else 0.0
+        return {
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': duration,
+            'bytes_per_second': downloaded / duration if duration else 0.0,
+            # per connection, without the time spent waiting for a slot or the rate limiter
+            'download_bytes_per_second': downloaded / download_time if download_time else 0.0,
+            'counters': self.counters,
+            'gauges': self.gauges,
+            'requests': {str(status): count for status, count in sorted(self.requests.items())},
+            'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+            'queues': {name: depth.to_dict() for name, depth in self.queues.items()},
+        }
+
+    def write_json(self, path: str):
+        write_atomic(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path: str):
+        # textfile collector format, written atomically so node_exporter never reads half a file
+        write_atomic(path, self.prometheus_text())
+
+    def prometheus_text(self) -> str:
+        report = self.report()
+        lines = [
+            f'# TYPE {PROMETHEUS_PREFIX}_run_duration_seconds gauge',
+            f'{PROMETHEUS_PREFIX}_run_duration_seconds {report["duration_seconds"]}',
+            f'# TYPE {PROMETHEUS_PREFIX}_bytes_per_second gauge',
+            f'{PROMETHEUS_PREFIX}_bytes_per_second {report["bytes_per_second"]}',
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines += [f'# TYPE {PROMETHEUS_PREFIX}_{name}_total counter', f'{PROMETHEUS_PREFIX}_{name}_total {value}']
+        for name, value in sorted(self.gauges.items()):
+            lines += [f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge', f'{PROMETHEUS_PREFIX}_{name} {value}']
+
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_requests_total counter')
+        lines += [f'{PROMETHEUS_PREFIX}_requests_total{{status="{status}"}} {count}' for status, count in sorted(self.requests.items())]
+
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_queue_depth_max gauge')
+        lines += [f'{PROMETHEUS_PREFIX}_queue_depth_max{{queue="{name}"}} {depth.max}' for name, depth in self.queues.items()]
+
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_stage_duration_seconds histogram')
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_duration_seconds_bucket{{stage="{stage}",le="{format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else str(bound)
+
+def write_atomic(path: str, text: str):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,60 @@
+import asyncio
+from time import monotonic
+
+
+def parse_retry_after(value: str | None, default: float = 1.0) -> float:
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return default # HTTP-date form is not used by Danbooru
+
+
+class RateLimiter:
+    '''
+    Token bucket shared by every request of a run.
+    Up to `burst` requests go through immediately, afterwards `rate` tokens per second are refilled.
+    '''
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        async with self._lock: # keeps waiters in FIFO order
+            start = now = monotonic()
+            if self.blocked_until > now:
+                await asyncio.sleep(self.blocked_until - now)
+                now = monotonic()
+            self._refill(now)
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill(monotonic())
+            self.tokens -= 1
+            self.requests += 1
+            waited = monotonic() - start
+            self.total_wait += waited
+            return waited
+
+    def penalize(self, retry_after: float):
+        # Server told us to slow down: empty the bucket and pause everyone
+        self.throttled += 1
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, monotonic() + retry_after)
+
+    def reset_counters(self):
+        # Reports are per run, the bucket itself keeps its state
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait = 0.0
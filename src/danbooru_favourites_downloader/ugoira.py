@@ -0,0 +1,86 @@
+import io
+import json
+import os
+import zipfile
+from hashlib import md5
+from PIL import Image
+
+# Peak memory of a conversion is about three decoded frames (width * height * 4 bytes each: the
+# current frame, its encoder copy and the previous canvas libwebp keeps for diffing) plus the
+# compressed WebP output, no matter how many frames the ugoira has.
+# A 1920x1080 ugoira stays below ~30 MB of frame data per conversion process.
+
+
+class HashingWriter:
+    # File wrapper that hashes everything written through it, so the output never has to be read back
+    def __init__(self, f):
+        self.f = f
+        self.hash = md5()
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class ZipFrameSequence(Image.Image):
+    '''
+    Multi-frame image backed by the frames of an ugoira zip.
+    Pillow's WebP encoder walks a multi-frame image with seek(), so only the current frame is ever decoded.
+    '''
+    def __init__(self, zip: zipfile.ZipFile, frame_files: list[str]):
+        super().__init__()
+        self._zip = zip
+        self._frame_files = frame_files
+        self.n_frames = len(frame_files)
+        self.is_animated = self.n_frames > 1
+        self._frame = -1
+        self.seek(0)
+
+    def seek(self, frame: int):
+        if frame == self._frame:
+            return
+        with Image.open(io.BytesIO(self._zip.read(self._frame_files[frame]))) as img:
+            decoded = img.convert('RGBA')
+        self.im = decoded.im # replaces the previous frame, which is freed here
+        self._mode = decoded.mode
+        self._size = decoded.size
+        self._frame = frame
+
+    def tell(self) -> int:
+        return self._frame
+
+
+def read_frame_list(zip: zipfile.ZipFile, duration: float | None) -> tuple[list[str], list[int] | int]:
+    meta_file = next((f for f in zip.namelist() if f.endswith(".json")), None)
+    if meta_file:
+        meta = json.loads(zip.read(meta_file))
+        return [f['file'] for f in meta['frames']], [f['delay'] for f in meta['frames']]
+    frame_files = sorted(
+        f for f in zip.namelist()
+        if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+    )
+    return frame_files, int((duration or len(frame_files)) * 1000 / len(frame_files))
+
+
+def convert_ugoira(path_to_zip: str, partial_file: str, output_file: str, duration: float | None) -> str:
+    # Runs inside the conversion process pool, so it only takes and returns picklable values
+    with zipfile.ZipFile(path_to_zip) as zip: # needs absolute path
+        frame_files, durations = read_frame_list(zip, duration)
+        frames = ZipFrameSequence(zip, frame_files)
+
+        with open(partial_file, 'wb') as f:
+            writer = HashingWriter(f)
+            frames.save(
+                writer,
+                save_all=True,
+                duration=durations,
+                loop=0,
+                format='WEBP',
+                lossless=True
+            )
+    os.replace(partial_file, output_file)
+    os.remove(path_to_zip)
+    return writer.hash.hexdigest()
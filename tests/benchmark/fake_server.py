@@ -0,0 +1,205 @@
+import asyncio
+import random
+import re
+from dataclasses import dataclass
+from hashlib import md5, sha256
+from aiohttp import web
+
+# Local stand-in for the parts of the Danbooru API the downloader uses
+
+
+@dataclass
+class FakeConfig:
+    posts: int = 500
+    file_size: int = 256 * 1024 # bytes per file
+    latency: float = 0.0 # seconds added to every response
+    error_rate: float = 0.0 # share of file requests answered with a 503
+    seed: int = 0
+
+
+ORIGINAL_SIZE = (1200, 1600)
+VARIANTS = (('180x180', 135, 180, 'jpg'), ('360x360', 270, 360, 'jpg'), ('720x720', 540, 720, 'webp'), ('sample', 850, 1133, 'jpg'))
+
+
+def variant_size(file_size: int, variant: str) -> int:
+    # smaller by the share of pixels the variant keeps
+    _, width, height, _ = next(v for v in VARIANTS if v[0] == variant)
+    return max(1, file_size * width * height // (ORIGINAL_SIZE[0] * ORIGINAL_SIZE[1]))
+
+
+def file_body(post_id: int, size: int) -> bytes:
+    block = sha256(str(post_id).encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def select_fields(post: dict, only: str) -> dict:
+    # the part of the API's only= syntax the downloader uses: field,association[field,field]
+    selected = {}
+    for name, nested in re.findall(r'(\w+)(?:\[([^\]]*)\])?', only):
+        if name in post:
+            selected[name] = {key: post[name][key] for key in nested.split(',') if key in post[name]} if nested else post[name]
+    return selected
+
+
+class FakeDanbooru:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.base_url = ''
+        self.requests = 0
+        self.failed = 0
+        self.md5s: dict[int, str] = {}
+        self.ids = list(range(config.posts, 0, -1)) # favourites come newest first
+
+    def post_json(self, post_id: int) -> dict:
+        # shaped like a real response, which carries far more than the downloader reads
+        if post_id not in self.md5s:
+            self.md5s[post_id] = md5(file_body(post_id, self.config.file_size)).hexdigest()
+        post_md5 = self.md5s[post_id]
+        return {
+            'id': post_id,
+            'created_at': '2024-01-01T00:00:00.000-05:00',
+            'uploader_id': post_id % 1000,
+            'score': post_id % 100,
+            'source': f'https://example.com/artworks/{post_id}',
+            'md5': post_md5,
+            'last_comment_bumped_at': None,
+            'rating': 'gsqe'[post_id % 4],
+            'image_width': ORIGINAL_SIZE[0],
+            'image_height': ORIGINAL_SIZE[1],
+            'tag_string': f'tag_{post_id % 50} tag_{post_id % 7} common_tag character_{post_id % 20} original artist_{post_id % 30} highres',
+            'fav_count': post_id % 500,
+            'file_ext': 'jpg',
+            'last_noted_at': None,
+            'parent_id': None,
+            'has_children': False,
+            'approver_id': None,
+            'tag_count_general': 3,
+            'tag_count_artist': 1,
+            'tag_count_character': 1,
+            'tag_count_copyright': 1,
+            'file_size': self.config.file_size,
+            'up_score': post_id % 100,
+            'down_score': 0,
+            'is_pending': False,
+            'is_flagged': False,
+            'is_deleted': False,
+            'tag_count': 7,
+            'updated_at': '2024-01-02T00:00:00.000-05:00',
+            'is_banned': False,
+            'pixiv_id': post_id,
+            'last_commented_at': None,
+            'has_active_children': False,
+            'bit_flags': 0,
+            'tag_count_meta': 1,
+            'has_large': True,
+            'has_visible_children': False,
+            'media_asset': {
+                'id': post_id + 100000,
+                'created_at': '2024-01-01T00:00:00.000-05:00',
+                'updated_at': '2024-01-01T00:00:00.000-05:00',
+                'md5': post_md5,
+                'file_ext': 'jpg',
+                'file_size': self.config.file_size,
+                'image_width': ORIGINAL_SIZE[0],
+                'image_height': ORIGINAL_SIZE[1],
+                'duration': None,
+                'status': 'active',
+                'file_key': f'key{post_id:08d}',
+                'is_public': True,
+                'pixel_hash': post_md5[::-1],
+                'variants': [
+                    {'type': variant, 'url': f'{self.base_url}/data/{variant}/{post_id}.{ext}', 'width': width, 'height': height, 'file_ext': ext}
+                    for variant, width, height, ext in VARIANTS
+                ] + [{'type': 'original', 'url': f'{self.base_url}/data/{post_id}.jpg', 'width': ORIGINAL_SIZE[0], 'height': ORIGINAL_SIZE[1], 'file_ext': 'jpg'}],
+            },
+            'tag_string_general': f'tag_{post_id % 50} tag_{post_id % 7} common_tag',
+            'tag_string_character': f'character_{post_id % 20}',
+            'tag_string_copyright': 'original',
+            'tag_string_artist': f'artist_{post_id % 30}',
+            'tag_string_meta': 'highres',
+            'file_url': f'{self.base_url}/data/{post_id}.jpg',
+            'large_file_url': f'{self.base_url}/data/sample/{post_id}.jpg',
+            'preview_file_url': f'{self.base_url}/data/180x180/{post_id}.jpg',
+        }
+
+    def select(self, tags: str, page: str, limit: int) -> list[int]:
+        for tag in tags.split():
+            if tag.startswith('id:'):
+                wanted = {int(id) for id in tag[3:].split(',')}
+                return [id for id in self.ids if id in wanted][:limit]
+        if page.startswith('b'):
+            before = int(page[1:])
+            return [id for id in self.ids if id < before][:limit]
+        start = (int(page) - 1) * limit
+        return self.ids[start:start + limit]
+
+    async def respond(self):
+        self.requests += 1
+        if self.config.latency > 0:
+            await asyncio.sleep(self.config.latency)
+
+    async def posts(self, request: web.Request) -> web.Response:
+        await self.respond()
+        ids = self.select(request.query.get('tags', ''), request.query.get('page', '1'), int(request.query.get('limit', 20)))
+        posts = [self.post_json(id) for id in ids]
+        if 'only' in request.query:
+            posts = [select_fields(post, request.query['only']) for post in posts]
+        return web.json_response(posts)
+
+    async def post(self, request: web.Request) -> web.Response:
+        await self.respond()
+        post_id = int(request.match_info['id'])
+        if not 1 <= post_id <= self.config.posts:
+            raise web.HTTPNotFound()
+        return web.json_response(self.post_json(post_id))
+
+    async def file(self, request: web.Request) -> web.Response:
+        await self.respond()
+        if self.random.random() < self.config.error_rate:
+            self.failed += 1
+            raise web.HTTPServiceUnavailable()
+        body = file_body(int(request.match_info['id']), self.config.file_size)
+        range_header = request.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            start = int(range_header[6:].split('-')[0])
+            if start >= len(body):
+                raise web.HTTPRequestRangeNotSatisfiable()
+            return web.Response(status=206, body=body[start:])
+        return web.Response(body=body)
+
+    async def variant_file(self, request: web.Request) -> web.Response:
+        await self.respond()
+        size = variant_size(self.config.file_size, request.match_info['variant'])
+        return web.Response(body=file_body(int(request.match_info['id']), size))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/posts.json', self.posts)
+        app.router.add_get('/posts/{id}.json', self.post)
+        app.router.add_get('/data/{id}.jpg', self.file)
+        app.router.add_get('/data/{variant}/{id}.{ext}', self.variant_file)
+        return app
+
+
+async def start_server(config: FakeConfig, host: str = '127.0.0.1', port: int = 0) -> tuple[FakeDanbooru, web.AppRunner]:
+    server = FakeDanbooru(config)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    server.base_url = f'http://{host}:{port}'
+    return server, runner
+
+
+def serve(config: FakeConfig, port: int, ready):
+    # Entry point of the server process, so its memory doesn't count towards the downloader's peak RSS
+    async def run():
+        _, runner = await start_server(config, port=port)
+        ready.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+    asyncio.run(run())
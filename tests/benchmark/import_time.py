@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+# Measures the cold start of the CLI with python -X importtime, e.g.
+#   python -m tests.benchmark.import_time
+# prints the total import time and the slowest imports of `import danbooru_favourites_downloader.main`.
+
+HEAVY_MODULES = ('PIL', 'aiohttp', 'alive_progress', 'zipfile', 'dotenv')
+
+
+def import_times(code: str = 'import danbooru_favourites_downloader.main') -> dict[str, int]:
+    # cumulative import time in microseconds by module, as reported by -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def heavy_imports(times: dict[str, int]) -> list[str]:
+    return [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+
+def main():
+    times = import_times()
+    total = times['danbooru_favourites_downloader.main']
+    print(f"import danbooru_favourites_downloader.main: {total / 1000:.1f} ms")
+    for name, cumulative in sorted(times.items(), key=lambda item: item[1], reverse=True)[1:11]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    if heavy := heavy_imports(times):
+        print(f"Heavy modules loaded at start up: {', '.join(heavy)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from time import monotonic
+
+from danbooru_favourites_downloader.main import a_main, DownloadMode
+from tests.benchmark.fake_server import FakeConfig, serve
+
+# Runs a full download against a local fake Danbooru, e.g.
+#   python -m tests.benchmark.run_benchmark --posts 2000 --file-size-kb 512 --latency-ms 20 --error-rate 0.01
+# and prints posts/sec, MB/sec, peak RSS and the per-stage timings of the run as JSON.
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def fake_danbooru(config: FakeConfig):
+    port = free_port()
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    process = context.Process(target=serve, args=(config, port, ready), daemon=True)
+    process.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("fake Danbooru server did not start")
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.join()
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+def run_benchmark(config: FakeConfig, work_directory: str, max_downloads: int = 16, rate_limit: float = 10_000,
+                  file_variant: str = 'original') -> dict:
+    metrics_file = os.path.join(work_directory, 'run-metrics.json')
+    saved_environment = os.environ.copy()
+    with fake_danbooru(config) as base_url:
+        os.environ.update({
+            'ACCOUNT_NAME': 'benchmark',
+            'API_KEY': 'benchmark',
+            'BASE_URL': base_url,
+            'FILE_DIRECTORY': os.path.join(work_directory, 'files'),
+            'DB_LOCATION': work_directory,
+            'CONVERT_UGOIRA_TO_WEBP': 'False',
+            'RATE_LIMIT': str(rate_limit),
+            'RATE_LIMIT_BURST': str(int(rate_limit)),
+            'MAX_DOWNLOADS': str(max_downloads),
+            'METRICS_FILE': metrics_file,
+            'FILE_VARIANT': file_variant,
+        })
+        try:
+            start = monotonic()
+            with redirect_stdout(sys.stderr): # keeps stdout for the result
+                asyncio.run(a_main(DownloadMode.NORMAL))
+            wall_time = monotonic() - start
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environment)
+
+    with open(metrics_file, encoding='utf-8') as f:
+        metrics = json.load(f)
+    duration = metrics['duration_seconds'] # pipeline only, without start up and shut down
+    downloaded = metrics['counters'].get('posts_downloaded', 0)
+    return {
+        'config': vars(config),
+        'max_downloads': max_downloads,
+        'file_variant': file_variant,
+        'posts_downloaded': downloaded,
+        'posts_failed': metrics['counters'].get('posts_failed', 0),
+        'duration_seconds': duration,
+        'wall_time_seconds': wall_time,
+        'posts_per_second': downloaded / duration if duration else 0.0,
+        'mb_per_second': metrics['bytes_per_second'] / (1 << 20),
+        'downloaded_mb': metrics['counters'].get('downloaded_bytes', 0) / (1 << 20),
+        'peak_rss_mb': peak_rss_mb(),
+        'concurrency_peak': metrics['gauges'].get('concurrency_peak'),
+        'stages': {stage: {key: values[key] for key in ('count', 'mean_seconds', 'p95_seconds', 'total_seconds')}
+                   for stage, values in metrics['stages'].items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a full download against a local fake Danbooru server")
+    parser.add_argument('--posts', type=int, default=FakeConfig.posts)
+    parser.add_argument('--file-size-kb', type=int, default=FakeConfig.file_size // 1024)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--max-downloads', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--file-variant', default='original', help="FILE_VARIANT of the run, e.g. max_pixels:500000")
+    parser.add_argument('--output', help="also write the result to this JSON file, e.g. to compare two branches")
+    args = parser.parse_args()
+
+    config = FakeConfig(args.posts, args.file_size_kb * 1024, args.latency_ms / 1000, args.error_rate, args.seed)
+    with tempfile.TemporaryDirectory() as work_directory:
+        result = run_benchmark(config, work_directory, args.max_downloads, file_variant=args.file_variant)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
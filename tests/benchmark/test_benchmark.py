@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import aiohttp
+import pytest
+from hashlib import md5
+
+from tests.benchmark.fake_server import FakeConfig, start_server, file_body, select_fields
+from tests.benchmark.run_benchmark import run_benchmark
+
+# Small runs that keep the benchmark working, real measurements use run_benchmark.py
+
+
+@pytest.mark.asyncio()
+async def test_fake_server_pages_and_ranges():
+    server, runner = await start_server(FakeConfig(posts=5, file_size=1000))
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{server.base_url}/posts.json', params={'tags': 'ordfav:x', 'limit': 2, 'page': 'b4'}) as resp:
+                posts = await resp.json()
+            async with session.get(posts[0]['file_url'], headers={'Range': 'bytes=400-'}) as resp:
+                assert resp.status == 206
+                assert len(await resp.read()) == 600
+            async with session.get(f'{server.base_url}/posts/9.json') as resp:
+                assert resp.status == 404
+    finally:
+        await runner.cleanup()
+
+    assert [post['id'] for post in posts] == [3, 2]
+    assert posts[0]['md5'] == md5(file_body(3, 1000)).hexdigest()
+
+
+def test_benchmark_downloads_every_post(tmp_path):
+    config = FakeConfig(posts=30, file_size=16 * 1024, error_rate=0.1, seed=1)
+    result = run_benchmark(config, str(tmp_path), max_downloads=4)
+
+    assert result['posts_downloaded'] == 30
+    assert result['posts_failed'] == 0
+    assert result['posts_per_second'] > 0
+    assert result['mb_per_second'] > 0
+    assert result['peak_rss_mb'] > 0
+    assert 'download' in result['stages']
+    assert len(os.listdir(tmp_path / 'files')) == 30
+
+
+def test_fake_server_selects_fields():
+    post = {"id": 1, "md5": "abc", "score": 5, "media_asset": {"duration": 1.5, "variants": []}}
+
+    assert select_fields(post, "id,md5,media_asset[duration]") == {"id": 1, "md5": "abc", "media_asset": {"duration": 1.5}}
+
+
+def test_benchmark_downloads_the_chosen_variant(tmp_path):
+    config = FakeConfig(posts=10, file_size=64 * 1024)
+    result = run_benchmark(config, str(tmp_path), max_downloads=4, file_variant="max_pixels:500000")
+
+    assert result['posts_downloaded'] == 10
+    assert result['downloaded_mb'] < 10 * 64 / 1024 / 4
+    assert all(name.endswith(".webp") for name in os.listdir(tmp_path / 'files'))
+    with sqlite3.connect(tmp_path / 'post-downloads.db') as con:
+        assert con.execute("SELECT DISTINCT variant FROM posts").fetchall() == [("720x720",)]
@@ -0,0 +1,12 @@
+from tests.benchmark.import_time import import_times, heavy_imports
+
+
+def test_heavy_dependencies_are_not_imported_at_start_up():
+    # they're loaded by the code paths that need them, see the imports inside main.py
+    assert heavy_imports(import_times()) == []
+
+
+def test_help_does_not_import_heavy_dependencies():
+    code = 'import sys; sys.argv = ["danbooru", "--help"]\nfrom danbooru_favourites_downloader.main import main\ntry: main()\nexcept SystemExit: pass'
+
+    assert heavy_imports(import_times(code)) == []
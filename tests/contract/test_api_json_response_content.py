@@ -1,6 +1,8 @@
 import aiohttp
 import pytest
 
+from danbooru_favourites_downloader.main import POST_FIELDS
+
 
 
 @pytest.mark.asyncio()
@@ -42,4 +44,16 @@ async def test_api_json_response_content(url, params):
     assert "has_children" in data
     assert "has_active_children" in data
     assert "file_ext" in data
-    assert "duration" in data['media_asset']
\ No newline at end of file
+    assert "duration" in data['media_asset']
+
+
+@pytest.mark.asyncio()
+async def test_api_returns_only_the_requested_fields():
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://danbooru.donmai.us/posts.json", params={'limit': 20, 'page': 1, 'only': POST_FIELDS}) as resp:
+            resp.raise_for_status()
+            data = (await resp.json())[0]
+
+    assert set(data) == {"id", "md5", "file_url", "file_ext", "tag_string_general", "tag_string_character", "tag_string_copyright",
+                         "tag_string_artist", "tag_string_meta", "rating", "parent_id", "has_children", "has_active_children", "media_asset"}
+    assert set(data['media_asset']) == {"duration"}
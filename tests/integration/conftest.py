@@ -6,6 +6,8 @@ from unittest.mock import Mock, create_autospec
 
 from danbooru_favourites_downloader.main import DownloadMode, Environment, Urls, Context
 from danbooru_favourites_downloader.database import Database
+from danbooru_favourites_downloader.rate_limiter import RateLimiter
+from danbooru_favourites_downloader.concurrency import ConcurrencyController
 
 @pytest_asyncio.fixture
 async def context():
@@ -20,7 +22,6 @@ async def context():
     urls = Urls(
         base_url="https://danbooru.donmai.us",
         search_result_endpoint="/posts.json",
-        specific_post_endpoint="/posts/{0}.json",
     )
 
     database = Database(":memory:")
@@ -34,8 +35,8 @@ async def context():
         mode=DownloadMode.NORMAL,
         authenticator=authenticator,
         urls=urls,
-        rate_limit_interval=1.0,
-        semaphore=asyncio.Semaphore(10),
+        rate_limiter=RateLimiter(10, 100),
+        concurrency=ConcurrencyController(),
     )
     
     yield ctx
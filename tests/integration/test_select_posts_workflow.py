@@ -5,6 +5,7 @@ from yarl import URL
 import re
 
 from danbooru_favourites_downloader.main import select_posts, DownloadMode, Context
+from tests.utils import collect
 
 
 @pytest.mark.asyncio
@@ -31,43 +32,48 @@ async def test_select_posts_normal_mode(context:Context, latest_id:int):
 
     with aioresponses() as mocked:
         mocked.get(url_pattern, callback=callback, repeat=True)
-        posts = await select_posts(context)
+        posts = await collect(select_posts(context))
     
     assert len(mocked.requests) == (2 if latest_id == 22 else 3)
-    post_ids = [p["id"] for p in posts]
+    post_ids = [p.id for p in posts]
     assert post_ids == ([105, 67, 100, 99, 11] if latest_id == 22 else [105, 67, 100, 99, 11, 22, 33, 44])
 
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
-     "error_ids",
+     "error_ids, deleted_ids",
      [
           (
-            [10, 20, 30, 40]   
+            [10, 20, 30, 40], []
           ),
           (
-            []
+            [10, 20, 30, 40], [20]
+          ),
+          (
+            [], []
           )
      ]
 )
-async def test_select_posts_retry_mode(context:Context, error_ids:list[int]):
+async def test_select_posts_retry_mode(context:Context, error_ids:list[int], deleted_ids:list[int]):
     context.mode = DownloadMode.RETRY
     for id in error_ids:
          context.database.insert_id_to_error(id)
-    
-    url = "https://danbooru.donmai.us/posts/{0}.json"
-    un = "username"
+
+    def callback(url:URL, **kwargs):
+        tags = kwargs["params"]["tags"]
+        ids = [int(id) for id in tags.split()[0].removeprefix("id:").split(",")]
+        payload = [{"id": id, "other": "ignore this"} for id in sorted(ids, reverse=True) if id not in deleted_ids]
+        return CallbackResult(status=200, payload=payload)
+
+    url_pattern = re.compile(r"https://danbooru\.donmai\.us/posts\.json.*")
 
     with aioresponses() as mocked:
-        for id in error_ids:
-            mocked.get(
-                url.format(id),
-                payload={"id": id, "other": "ignore this"}
-            )
-        posts = await select_posts(context)
-    
-    post_ids = [p["id"] for p in posts]
-    assert post_ids == error_ids
+        mocked.get(url_pattern, callback=callback, repeat=True)
+        posts = await collect(select_posts(context))
+
+    post_ids = sorted(p.id for p in posts)
+    assert post_ids == [id for id in error_ids if id not in deleted_ids]
+    assert sorted(context.database.get_error_ids()) == post_ids
 
 
 @pytest.mark.asyncio
@@ -100,11 +106,11 @@ async def test_select_posts_force_mode(context:Context, latest_id:int):
         mocked.get(url_pattern, callback=callback, repeat=True)
 
         async with aiohttp.ClientSession() as session:
-            posts = await select_posts(context)
+            posts = await collect(select_posts(context))
 
     assert call_count == 3
     assert len(mocked.requests) == 3
-    post_ids = [p["id"] for p in posts]
+    post_ids = [p.id for p in posts]
     assert post_ids == [105, 67, 100, 99, 11, 22, 33, 44]
 
 
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+
+from danbooru_favourites_downloader.concurrency import ConcurrencyController
+
+
+def complete_window(controller: ConcurrencyController, size: int, latency: float = 0.01):
+    for _ in range(controller.limit):
+        controller.record(200, size, latency)
+
+
+def test_limit_grows_while_throughput_rises():
+    controller = ConcurrencyController(initial=2, maximum=4)
+    for size in (1_000, 10_000, 100_000):
+        complete_window(controller, size)
+
+    assert controller.limit == 4
+    assert controller.peak_limit == 4
+
+
+def test_limit_stops_at_maximum():
+    controller = ConcurrencyController(initial=2, maximum=3)
+    for size in (1_000, 10_000, 100_000, 1_000_000):
+        complete_window(controller, size)
+
+    assert controller.limit == 3
+
+
+@pytest.mark.parametrize("status", [0, 429, 500, 503])
+def test_limit_halves_on_errors(status):
+    controller = ConcurrencyController(initial=8)
+    controller.record(status, 0, 0.01)
+
+    assert controller.limit == 4
+
+
+def test_limit_never_drops_below_minimum():
+    controller = ConcurrencyController(initial=2, minimum=1)
+    for _ in range(5):
+        controller.record(429, 0, 0.01)
+
+    assert controller.limit == 1
+
+
+@pytest.mark.asyncio()
+async def test_concurrent_failures_halve_the_limit_once():
+    controller = ConcurrencyController(initial=16, maximum=16)
+    started = asyncio.Event()
+
+    async def failing_download():
+        async with controller.slot() as sample:
+            await started.wait()
+            sample.status = 503
+
+    tasks = [asyncio.create_task(failing_download()) for _ in range(12)]
+    await asyncio.sleep(0)
+    started.set()
+    await asyncio.gather(*tasks)
+
+    assert controller.limit == 8
+
+    async with controller.slot() as sample: # started after the decrease, so it counts again
+        sample.status = 503
+    assert controller.limit == 4
+
+
+def test_limit_halves_when_latency_climbs():
+    controller = ConcurrencyController(initial=4)
+    complete_window(controller, 1_000_000, latency=0.01)
+    limit = controller.limit
+    complete_window(controller, 1, latency=1.0)
+
+    assert controller.limit == limit // 2
+
+
+def test_samples_without_request_are_ignored():
+    controller = ConcurrencyController(initial=2)
+    for _ in range(10):
+        controller.record(None, 0, 0.01)
+
+    assert controller.limit == 2
+    assert controller.window_count == 0
+
+
+@pytest.mark.asyncio()
+async def test_slot_enforces_limit():
+    controller = ConcurrencyController(initial=2, maximum=2)
+    running = 0
+    peak = 0
+
+    async def download():
+        nonlocal running, peak
+        async with controller.slot() as sample:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            sample.status, sample.size = 200, 100
+
+    await asyncio.gather(*(download() for _ in range(10)))
+
+    assert peak == 2
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio()
+async def test_slot_records_failed_download():
+    controller = ConcurrencyController(initial=4)
+
+    with pytest.raises(RuntimeError):
+        async with controller.slot() as sample:
+            sample.status = 503
+            raise RuntimeError()
+
+    assert controller.limit == 2
+    assert controller.active == 0
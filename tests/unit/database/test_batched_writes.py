@@ -0,0 +1,70 @@
+import pytest
+from danbooru_favourites_downloader.database import Database, PostMetaData
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "posts.db"), flush_rows=3, flush_interval=3600)
+    yield database
+    database.close()
+
+
+def count_posts(path) -> int:
+    other = Database(path)
+    count = other.cur.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+    other.close()
+    return count
+
+
+def test_rows_are_flushed_in_batches(db:Database, tmp_path):
+    path = str(tmp_path / "posts.db")
+    db.insert_post_data(PostMetaData(1))
+    db.insert_post_data(PostMetaData(2))
+    assert count_posts(path) == 0
+
+    db.insert_post_data(PostMetaData(3))
+    assert count_posts(path) == 3
+    assert db.pending_posts == []
+
+
+def test_flush_interval(tmp_path):
+    path = str(tmp_path / "posts.db")
+    db = Database(path, flush_rows=1000, flush_interval=0)
+    db.insert_post_data(PostMetaData(1))
+
+    assert count_posts(path) == 1
+    db.close()
+
+
+def test_close_flushes_pending_rows(tmp_path):
+    path = str(tmp_path / "posts.db")
+    with Database(path, flush_rows=1000, flush_interval=3600) as db:
+        db.insert_post_data(PostMetaData(1))
+        db.insert_id_to_error(2)
+
+    with Database(path) as db:
+        assert db.get_error_ids() == [2]
+    assert count_posts(path) == 1
+
+
+def test_reinserting_a_post_updates_it(db:Database):
+    db.insert_post_data(PostMetaData(1, md5="old"))
+    db.insert_post_data(PostMetaData(1, md5="new"))
+    db.insert_id_to_error(5)
+    db.insert_id_to_error(5)
+    db.flush()
+
+    assert db.cur.execute("SELECT md5 FROM posts").fetchall() == [("new",)]
+    assert db.get_error_ids() == [5]
+
+
+def test_remove_from_error_drops_pending_row(db:Database):
+    db.insert_id_to_error(7)
+    db.remove_from_error(7)
+    db.flush()
+
+    assert db.get_error_ids() == []
+
+
+def test_wal_mode(db:Database):
+    assert db.cur.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
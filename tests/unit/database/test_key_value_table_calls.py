@@ -16,4 +16,31 @@ def test_set_and_get_newest_downloaded_id(db:Database):
     assert db.get_newest_downloaded_id() == 42
 
     db.set_newest_downloaded_id(100)
-    assert db.get_newest_downloaded_id() == 100
\ No newline at end of file
+    assert db.get_newest_downloaded_id() == 100
+
+def test_sources_keep_separate_checkpoints(db:Database):
+    db.set_newest_downloaded_id(42)
+    db.set_newest_downloaded_id(7, "tags:cat_ears")
+
+    assert db.get_newest_downloaded_id() == 42
+    assert db.get_newest_downloaded_id("tags:cat_ears") == 7
+    assert db.get_newest_downloaded_id("pool:1") == 0
+
+def test_run_state_moves_the_watermark_when_finished(db:Database):
+    db.set_newest_downloaded_id(10, "tags:cat")
+    assert db.get_run_state("tags:cat") is None
+
+    db.set_run_state(50, "b40", "tags:cat")
+    assert db.get_run_state("tags:cat") == (50, "b40")
+    assert db.get_newest_downloaded_id("tags:cat") == 10
+
+    db.finish_run("tags:cat")
+    assert db.get_run_state("tags:cat") is None
+    assert db.get_newest_downloaded_id("tags:cat") == 50
+
+def test_queued_posts_stay_until_settled(db:Database):
+    db.queue_posts([3, 1, 2])
+    db.queue_posts([2])
+    db.settle_post(1)
+
+    assert db.get_queued_ids() == [3, 2]
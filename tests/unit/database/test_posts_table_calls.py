@@ -23,4 +23,31 @@ def test_insert_post_data(db):
     assert rows is not None
     assert rows[0] == 1
     assert rows[1] == "abc"
-    assert rows[7] == "s"
\ No newline at end of file
+    assert rows[7] == "s"
+
+def test_get_posts_by_md5(db):
+    db.insert_post_data(PostMetaData(1, md5="same", file_ext="png"))
+    db.insert_post_data(PostMetaData(2, md5="same", file_ext="jpg"))
+    db.insert_post_data(PostMetaData(3, md5="other", file_ext="png"))
+
+    assert sorted(db.get_posts_by_md5("same")) == [(1, "png", None), (2, "jpg", None)]
+    assert db.get_posts_by_md5("missing") == []
+
+
+def test_get_post(db):
+    db.insert_post_data(PostMetaData(1, md5="abc", file_ext="png"))
+
+    assert db.get_post(1) == ("abc", "png", None)
+    assert db.get_post(2) is None
+    assert db.get_post_ids() == {1}
+
+
+def test_file_hash_cache(db):
+    assert db.get_cached_md5("/a.png", 10, 5) is None
+
+    db.cache_md5("/a.png", 10, 5, "abc")
+    assert db.get_cached_md5("/a.png", 10, 5) == "abc"
+    assert db.get_cached_md5("/a.png", 11, 5) is None
+
+    db.cache_md5("/a.png", 11, 6, "def")
+    assert db.get_cached_md5("/a.png", 11, 6) == "def"
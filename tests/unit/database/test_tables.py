@@ -1,4 +1,5 @@
 import pytest
+import sqlite3
 from danbooru_favourites_downloader.database import Database, PostMetaData
 
 
@@ -24,4 +25,18 @@ def test_delete_tables(db:Database):
 def test_create_tables(db:Database):
     # on Database context-manager __init__ create_tables() is called
     tables = db.cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-    assert ("key_value_pairs",) in tables
\ No newline at end of file
+    assert ("key_value_pairs",) in tables
+
+def test_columns_are_added_to_old_databases(tmp_path):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as con:
+        con.execute("""CREATE TABLE posts (post_id INTEGER PRIMARY KEY, md5 TEXT, tag_string_general TEXT, tag_string_character TEXT,
+                       tag_string_copyright TEXT, tag_string_artist TEXT, tag_string_meta TEXT, rating TEXT, parent_id INTEGER,
+                       has_children BOOLEAN NOT NULL, has_active_children BOOLEAN NOT NULL, file_ext TEXT)""")
+
+    database = Database(path)
+    database.insert_post_data(PostMetaData(1, md5="abc", file_ext="webp", variant="720x720"))
+    database.commit()
+
+    assert database.cur.execute("SELECT md5, file_path, variant FROM posts").fetchone() == ("abc", None, "720x720")
+    database.close()
@@ -0,0 +1,100 @@
+import sqlite3
+import pytest
+from time import monotonic
+from danbooru_favourites_downloader.database import Database, PostMetaData
+
+
+def make_post(post_id:int, general:str = "", artist:str = "", character:str = "", rating:str = "g") -> PostMetaData:
+    return PostMetaData(post_id, md5=f"md5-{post_id}", tag_string_general=general, tag_string_artist=artist,
+                        tag_string_character=character, rating=rating, file_ext="png")
+
+
+@pytest.fixture
+def db():
+    database = Database(":memory:")
+    database.insert_post_data(make_post(1, "cat_ears smile :)", artist="someone", rating="g"))
+    database.insert_post_data(make_post(2, "cat_ears solo", artist="other", rating="s"))
+    database.insert_post_data(make_post(3, "dog_ears smile", character="hatsune_miku", rating="e"))
+    database.insert_post_data(make_post(4, "jeanne_d'arc_(fate) solo", artist="someone", rating="g"))
+    database.commit()
+    yield database
+    database.close()
+
+
+def ids(results) -> list[int]:
+    return [row[0] for row in results]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("cat_ears", [2, 1]),
+    ("cat_ears smile", [1]),
+    ("cat_ears -smile", [2]),
+    ("-cat_ears", [4, 3]),
+    ("smile -rating:e", [1]),
+    ("rating:g,s", [4, 2, 1]),
+    ("artist:someone", [4, 1]),
+    ("general:someone", []),
+    ("cat*", [2, 1]),
+    (":)", [1]),
+    ("jeanne_d'arc_(fate)", [4]),
+    ("SOLO", [4, 2]),
+    ("", [4, 3, 2, 1]),
+])
+def test_search_posts(db:Database, query, expected):
+    assert ids(db.search_posts(query)) == expected
+
+
+def test_normalized_tags(db:Database):
+    categories = dict(db.cur.execute("SELECT name, category FROM tags").fetchall())
+    assert categories["cat_ears"] == "general"
+    assert categories["hatsune_miku"] == "character"
+    tagged = db.cur.execute("""SELECT post_id FROM post_tags JOIN tags USING (tag_id)
+                               WHERE name = 'solo' ORDER BY post_id""").fetchall()
+    assert tagged == [(2,), (4,)]
+
+
+def test_updated_post_is_reindexed(db:Database):
+    db.insert_post_data(make_post(2, "fox_ears"))
+    db.commit()
+
+    assert ids(db.search_posts("cat_ears")) == [1]
+    assert ids(db.search_posts("fox_ears")) == [2]
+    assert db.cur.execute("SELECT COUNT(*) FROM post_tags WHERE post_id = 2").fetchone()[0] == 1
+
+
+def test_delete_tables_clears_index(db:Database):
+    db.delete_tables()
+
+    assert db.search_posts("cat_ears") == []
+    assert db.cur.execute("SELECT COUNT(*) FROM post_tags").fetchone()[0] == 0
+
+
+def test_existing_library_is_backfilled(tmp_path):
+    path = str(tmp_path / "old.db")
+    con = sqlite3.connect(path)
+    con.execute("""CREATE TABLE posts (post_id INTEGER PRIMARY KEY, md5 TEXT, tag_string_general TEXT,
+                   tag_string_character TEXT, tag_string_copyright TEXT, tag_string_artist TEXT, tag_string_meta TEXT,
+                   rating TEXT, parent_id INTEGER, has_children BOOLEAN NOT NULL, has_active_children BOOLEAN NOT NULL,
+                   file_ext TEXT)""")
+    con.execute("INSERT INTO posts VALUES (9, 'x', 'cat_ears', '', '', 'someone', '', 'g', NULL, 0, 0, 'jpg')")
+    con.commit()
+    con.close()
+
+    with Database(path) as db:
+        assert db.search_posts("artist:someone cat_ears") == [(9, "jpg", None)]
+        assert db.cur.execute("SELECT COUNT(*) FROM post_tags").fetchone()[0] == 2
+
+
+def test_search_is_fast_on_a_large_library():
+    db = Database(":memory:", flush_rows=10_000)
+    for post_id in range(1, 20_001):
+        db.insert_post_data(make_post(post_id, f"tag_{post_id % 500} common_{post_id % 7}", artist=f"artist_{post_id % 1000}"))
+    db.commit()
+
+    start = monotonic()
+    results = db.search_posts("tag_42 artist:artist_42 -common_0")
+    elapsed = monotonic() - start
+    db.close()
+
+    assert len(results) > 0
+    assert elapsed < 0.1
@@ -0,0 +1,22 @@
+import pytest
+from hashlib import md5
+
+from danbooru_favourites_downloader.main import PostRecord, Context
+from tests.utils import as_mock
+
+
+@pytest.fixture
+def file_directory(context: Context, tmp_path):
+    # Empty library, no cached hashes and no other post sharing an md5
+    context.environment.file_directory = str(tmp_path)
+    as_mock(context.database.get_cached_md5).return_value = None
+    as_mock(context.database.get_posts_by_md5).return_value = []
+    return tmp_path
+
+
+@pytest.fixture
+def make_post():
+    def _create(post_id: int, body: bytes, file_ext: str = "png") -> PostRecord:
+        return PostRecord(id=post_id, file_url=f"https://cdn.donmai.us/original/{post_id}.{file_ext}", file_ext=file_ext, md5=md5(body).hexdigest())
+
+    return _create
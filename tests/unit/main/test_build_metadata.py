@@ -1,4 +1,4 @@
-from danbooru_favourites_downloader.main import build_metadata
+from danbooru_favourites_downloader.main import build_metadata, PostRecord
 
 def test_build_metadata():
     post = {
@@ -16,9 +16,17 @@ def test_build_metadata():
         "file_ext": "jpg",
     }
 
-    meta = build_metadata(post)
+    meta = build_metadata(PostRecord.from_json(post))
 
     assert meta.post_id == 123, f"Expected value: 123, got: {meta.post_id}"
     assert meta.md5 == "SADbjf5349bg78D", f"Expected value: SADbjf5349bg78D, got: {meta.md5}"
     assert meta.file_ext == "jpg", f"Expected value: jpg, got: {meta.file_ext}"
     assert meta.rating == "g", f"Expected value: g, got: {meta.rating}"
+
+
+def test_post_record_keeps_only_what_is_used():
+    post = PostRecord.from_json({"id": 5, "file_ext": "zip", "score": 10, "media_asset": {"duration": 1.5, "variants": [{"type": "sample"}]}})
+
+    assert post == PostRecord(id=5, file_ext="zip", duration=1.5)
+    assert post.md5 == "" and post.file_url == "" # restricted posts come without them
+    assert not hasattr(post, "__dict__")
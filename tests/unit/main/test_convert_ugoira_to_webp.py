@@ -0,0 +1,59 @@
+import zipfile
+import pytest
+from hashlib import md5
+from PIL import Image
+from unittest.mock import patch
+
+from danbooru_favourites_downloader.main import convert_ugoira_to_webp, DownloadResult, PostRecord, Context
+from danbooru_favourites_downloader.ugoira import ZipFrameSequence, convert_ugoira
+from tests.utils import write_ugoira
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("with_meta", [True, False])
+async def test_convert_ugoira_to_webp(context: Context, tmp_path, with_meta):
+    context.environment.file_directory = str(tmp_path)
+    write_ugoira(tmp_path / "Danbooru_7.zip", 5, with_meta)
+    post = PostRecord(id=7, file_ext="zip", duration=0.5)
+
+    digest = await convert_ugoira_to_webp(context, DownloadResult(True, post, path=str(tmp_path / "Danbooru_7.zip")))
+
+    output = tmp_path / "Danbooru_7.webp"
+    assert not (tmp_path / "Danbooru_7.zip").exists()
+    assert digest == md5(output.read_bytes()).hexdigest()
+    with Image.open(output) as webp:
+        assert webp.n_frames == 5
+
+
+def test_zip_frame_sequence_decodes_one_frame_at_a_time(tmp_path):
+    write_ugoira(tmp_path / "frames.zip", 30)
+    opened = []
+    real_open = Image.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(1)
+        return real_open(*args, **kwargs)
+
+    with zipfile.ZipFile(tmp_path / "frames.zip") as zip:
+        with patch("danbooru_favourites_downloader.ugoira.Image.open", side_effect=counting_open):
+            frames = ZipFrameSequence(zip, [f"{i:06d}.png" for i in range(30)])
+            assert len(opened) == 1
+            frames.seek(12)
+            assert len(opened) == 2
+            assert frames.tell() == 12
+            assert frames.getpixel((0, 0)) == (12 * 40 % 256, 0, 0, 255)
+
+
+def test_convert_ugoira_keeps_frame_durations(tmp_path):
+    write_ugoira(tmp_path / "Danbooru_8.zip", 4)
+    output = tmp_path / "Danbooru_8.webp"
+
+    convert_ugoira(str(tmp_path / "Danbooru_8.zip"), str(output) + ".part", str(output), None)
+
+    with Image.open(output) as webp:
+        durations = []
+        for i in range(webp.n_frames):
+            webp.seek(i)
+            webp.load()
+            durations.append(webp.info["duration"])
+    assert durations == [50, 51, 52, 53]
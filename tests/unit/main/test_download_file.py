@@ -0,0 +1,92 @@
+import os
+import pytest
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader.main import download_file, md5_check, Context
+
+
+@pytest.mark.asyncio()
+async def test_download_file_hashes_while_streaming(context: Context, file_directory, make_post):
+    body = os.urandom(200_000)
+    post = make_post(1, body)
+
+    with aioresponses() as m:
+        m.get(post.file_url, body=body)
+        result = await download_file(context, post)
+
+    assert result.success
+    assert result.md5 == post.md5
+    assert not (file_directory / "Danbooru_1.png").exists()
+    assert await md5_check(context, result)
+    assert (file_directory / "Danbooru_1.png").read_bytes() == body
+    assert not (file_directory / "Danbooru_1.png.part").exists()
+
+
+@pytest.mark.asyncio()
+async def test_md5_check_removes_mismatching_file(context: Context, file_directory, make_post):
+    post = make_post(2, b"what the api promised")
+
+    with aioresponses() as m:
+        m.get(post.file_url, body=b"not what the api promised")
+        result = await download_file(context, post)
+
+    assert result.success
+    assert not await md5_check(context, result)
+    assert not (file_directory / "Danbooru_2.png").exists()
+    assert not (file_directory / "Danbooru_2.png.part").exists()
+
+
+@pytest.mark.asyncio()
+async def test_download_file_failure(context: Context, file_directory, make_post):
+    post = make_post(3, b"never arrives")
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=404)
+        result = await download_file(context, post)
+
+    assert not result.success
+    assert result.md5 == ""
+
+
+@pytest.mark.asyncio()
+async def test_download_file_resumes_partial_file(context: Context, file_directory, make_post):
+    body = os.urandom(100_000)
+    post = make_post(4, body, "mp4")
+    (file_directory / "Danbooru_4.mp4.part").write_bytes(body[:30_000])
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=206, body=body[30_000:])
+        result = await download_file(context, post)
+        request = next(iter(m.requests.values()))[0]
+
+    assert request.kwargs["headers"] == {"Range": "bytes=30000-"}
+    assert result.md5 == post.md5
+    assert await md5_check(context, result)
+    assert (file_directory / "Danbooru_4.mp4").read_bytes() == body
+
+
+@pytest.mark.asyncio()
+async def test_download_file_restarts_when_range_is_ignored(context: Context, file_directory, make_post):
+    body = os.urandom(50_000)
+    post = make_post(5, body, "zip")
+    (file_directory / "Danbooru_5.zip.part").write_bytes(b"stale bytes")
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=200, body=body)
+        result = await download_file(context, post)
+
+    assert result.md5 == post.md5
+    assert (file_directory / "Danbooru_5.zip.part").read_bytes() == body
+
+
+@pytest.mark.asyncio()
+async def test_download_file_keeps_partial_file_on_failure(context: Context, file_directory, make_post):
+    post = make_post(6, b"never arrives")
+    (file_directory / "Danbooru_6.png.part").write_bytes(b"first half")
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=503)
+        result = await download_file(context, post)
+
+    assert not result.success
+    assert (file_directory / "Danbooru_6.png.part").read_bytes() == b"first half"
@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from unittest.mock import Mock, patch
+
+from danbooru_favourites_downloader.main import produce_posts, download_worker, conversion_worker, DownloadResult, PostRecord, Context
+from tests.utils import as_mock, as_pages
+
+
+async def failing_pages(*_):
+    yield [PostRecord(id=5)]
+    raise RuntimeError("listing broke")
+
+
+async def run_pipeline(context: Context, bar, workers: int = 2):
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    conversions: asyncio.Queue = asyncio.Queue(maxsize=1)
+    converter = asyncio.create_task(conversion_worker(context, conversions, bar))
+    tasks = [asyncio.create_task(download_worker(context, queue, conversions, bar)) for _ in range(workers)]
+    newest_id, listing_complete = (await produce_posts(context, queue, len(tasks)))[None]
+    results = await asyncio.gather(*tasks)
+    await conversions.put(None)
+    results.append(await converter)
+    return newest_id, listing_complete, results
+
+
+@pytest.mark.asyncio()
+async def test_pipeline_overlaps_listing_and_downloads(context: Context):
+    pages = [[PostRecord(id=9), PostRecord(id=8)], [PostRecord(id=7), PostRecord(id=6)], [PostRecord(id=5)]]
+    downloaded = []
+
+    async def fake_download(_, post):
+        downloaded.append(post.id)
+        return DownloadResult(True, post)
+
+    bar = Mock()
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages(*pages)),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=fake_download),
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.finish_download", return_value=(1, 0))):
+        newest_id, listing_complete, results = await run_pipeline(context, bar)
+
+    assert newest_id == 9
+    assert listing_complete
+    assert sorted(downloaded) == [5, 6, 7, 8, 9]
+    assert sum(s for s, _ in results) == 5
+    assert bar.call_count == 5
+
+
+@pytest.mark.asyncio()
+async def test_pipeline_stops_workers_when_listing_fails(context: Context):
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=failing_pages),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=lambda _, post: DownloadResult(True, post)),
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.finish_download", return_value=(1, 0))):
+        newest_id, listing_complete, results = await run_pipeline(context, Mock(), workers=3)
+
+    assert newest_id == 5
+    assert not listing_complete
+    assert sum(s for s, _ in results) == 1
+
+
+@pytest.mark.asyncio()
+async def test_pipeline_hands_ugoira_to_conversion_stage(context: Context):
+    pages = [[PostRecord(id=3, file_ext="zip"), PostRecord(id=2, file_ext="png")]]
+    finished = []
+
+    async def fake_finish(_, result):
+        finished.append((result.post.id, result.post.file_ext, result.md5))
+        return (1, 0)
+
+    bar = Mock()
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages(*pages)),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=lambda _, post: DownloadResult(True, post)),
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.convert_ugoira_to_webp", return_value="webp-md5"),
+          patch("danbooru_favourites_downloader.main.finish_download", side_effect=fake_finish)):
+        _, _, results = await run_pipeline(context, bar)
+
+    assert sorted(finished) == [(2, "png", ""), (3, "webp", "webp-md5")]
+    assert sum(s for s, _ in results) == 2
+    assert bar.call_count == 2
+
+
+@pytest.mark.asyncio()
+async def test_conversion_failure_is_recorded_as_error(context: Context):
+    conversions: asyncio.Queue = asyncio.Queue()
+    await conversions.put(DownloadResult(True, PostRecord(id=4, file_ext="zip")))
+    await conversions.put(None)
+
+    with (patch("danbooru_favourites_downloader.main.convert_ugoira_to_webp", side_effect=OSError("broken zip")),
+          patch("danbooru_favourites_downloader.main.finish_download", return_value=(0, 1)) as mock_finish):
+        result = await conversion_worker(context, conversions, Mock())
+
+    assert result == (0, 1)
+    assert not mock_finish.call_args.args[1].success
+
+
+@pytest.mark.asyncio()
+async def test_pipeline_survives_a_post_that_raises(context: Context):
+    pages = [[PostRecord(id=9), PostRecord(id=8), PostRecord(id=7)], [PostRecord(id=6), PostRecord(id=5)]]
+
+    async def fake_md5_check(_, result):
+        if result.post.id == 8:
+            raise OSError("rename failed")
+        return True
+
+    bar = Mock()
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages(*pages)),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=lambda _, post: DownloadResult(True, post)),
+          patch("danbooru_favourites_downloader.main.md5_check", side_effect=fake_md5_check),
+          patch("danbooru_favourites_downloader.main.finish_download", return_value=(1, 0))):
+        newest_id, listing_complete, results = await run_pipeline(context, bar, workers=1)
+
+    assert listing_complete
+    assert sum(s for s, _ in results) == 4
+    assert sum(e for _, e in results) == 1
+    assert bar.call_count == 5
+    as_mock(context.database.insert_id_to_error).assert_called_once_with(8)
+
+
+@pytest.mark.asyncio()
+async def test_pipeline_records_stage_metrics(context: Context):
+    pages = [[PostRecord(id=3, file_ext="zip"), PostRecord(id=2, file_ext="png")]]
+
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages(*pages)),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=lambda _, post: DownloadResult(True, post)),
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.convert_ugoira_to_webp", return_value="webp-md5"),
+          patch("danbooru_favourites_downloader.main.handle_result", return_value=(1, 0))):
+        await run_pipeline(context, Mock())
+
+    stages = context.metrics.stages
+    assert stages["md5_check"].count == 2
+    assert stages["convert"].count == 1
+    assert stages["handle_result"].count == 2
+    assert context.metrics.queues["posts"].samples == 1
+    assert context.metrics.queues["conversions"].samples == 1
@@ -0,0 +1,97 @@
+import os
+import pytest
+import aiohttp
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader import main
+from danbooru_favourites_downloader.main import download_limiter, md5_check, backoff_delay, Context
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(main, "RETRY_BACKOFF_BASE", 0)
+
+
+def request_count(m: aioresponses) -> int:
+    return sum(len(calls) for calls in m.requests.values())
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("status", [500, 502, 503, 408])
+async def test_transient_status_is_retried(context: Context, file_directory, make_post, no_backoff, status):
+    body = os.urandom(5_000)
+    post = make_post(1, body)
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=status)
+        m.get(post.file_url, body=body)
+        result = await download_limiter(context, post)
+
+    assert result.success
+    assert await md5_check(context, result)
+
+
+@pytest.mark.asyncio()
+async def test_connection_error_is_retried(context: Context, file_directory, make_post, no_backoff):
+    body = os.urandom(5_000)
+    post = make_post(2, body)
+
+    with aioresponses() as m:
+        m.get(post.file_url, exception=aiohttp.ServerDisconnectedError())
+        m.get(post.file_url, exception=TimeoutError())
+        m.get(post.file_url, body=body)
+        result = await download_limiter(context, post)
+
+    assert result.success
+    assert result.md5 == post.md5
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("status", [403, 404, 410])
+async def test_permanent_failure_is_not_retried(context: Context, file_directory, make_post, no_backoff, status):
+    post = make_post(3, b"gone")
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=status, repeat=True)
+        result = await download_limiter(context, post)
+        assert request_count(m) == 1
+
+    assert not result.success
+    assert result.status == status
+
+
+@pytest.mark.asyncio()
+async def test_gives_up_after_configured_retries(context: Context, file_directory, make_post, no_backoff):
+    context.environment.download_retries = 2
+    post = make_post(4, b"never arrives")
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=503, repeat=True)
+        result = await download_limiter(context, post)
+        assert request_count(m) == 3
+
+    assert not result.success
+
+
+@pytest.mark.asyncio()
+async def test_retry_resumes_partial_file(context: Context, file_directory, make_post, no_backoff):
+    body = os.urandom(20_000)
+    post = make_post(5, body)
+    (file_directory / "Danbooru_5.png.part").write_bytes(body[:8_000])
+
+    with aioresponses() as m:
+        m.get(post.file_url, status=503)
+        m.get(post.file_url, status=206, body=body[8_000:])
+        result = await download_limiter(context, post)
+        ranges = [call.kwargs["headers"].get("Range") for calls in m.requests.values() for call in calls]
+
+    assert ranges == ["bytes=8000-", "bytes=8000-"]
+    assert await md5_check(context, result)
+    assert (file_directory / "Danbooru_5.png").read_bytes() == body
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(main.random, "uniform", lambda low, high: high)
+
+    assert [backoff_delay(attempt) for attempt in range(3)] == [1.0, 2.0, 4.0]
+    assert backoff_delay(10) == main.RETRY_BACKOFF_CAP
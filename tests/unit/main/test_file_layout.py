@@ -0,0 +1,151 @@
+import asyncio
+import io
+import os
+import pytest
+from hashlib import md5
+from aioresponses import aioresponses
+from unittest.mock import patch
+
+from danbooru_favourites_downloader.main import (layout_file_path, library_file_path, download_file, md5_check, handle_result,
+                                                 conversion_worker, migrate_library, move_library_file, verify_library, PostRecord, Context)
+from danbooru_favourites_downloader.database import Database, PostMetaData
+from tests.utils import as_mock, write_ugoira
+
+
+@pytest.mark.parametrize("layout, expected", [
+    ("flat", "Danbooru_1234567.png"),
+    ("id", os.path.join("01234", "Danbooru_1234567.png")),
+    ("md5", os.path.join("ab", "cd", "Danbooru_1234567.png")),
+])
+def test_layout_file_path(layout, expected):
+    assert layout_file_path(layout, 1234567, "png", "abcdef0123") == expected
+
+
+def test_library_file_path_prefers_stored_path():
+    assert library_file_path("/lib", 5, "png", os.path.join("00000", "Danbooru_5.png")) == os.path.join("/lib", "00000", "Danbooru_5.png")
+    assert library_file_path("/lib", 5, "png", None) == os.path.join("/lib", "Danbooru_5.png")
+
+
+@pytest.mark.asyncio()
+async def test_download_records_sharded_path(context: Context, tmp_path):
+    context.environment.file_directory = str(tmp_path)
+    context.environment.file_layout = "md5"
+    body = os.urandom(1000)
+    digest = md5(body).hexdigest()
+    post = PostRecord(id=3, file_url="https://cdn.donmai.us/original/3.png", file_ext="png", md5=digest,
+            tag_string_general="", tag_string_character="", tag_string_copyright="", tag_string_artist="",
+            tag_string_meta="", rating="g", parent_id=None)
+
+    with aioresponses() as m:
+        m.get(post.file_url, body=body)
+        result = await download_file(context, post)
+    assert await md5_check(context, result)
+    await handle_result(context, result)
+
+    relative = os.path.join(digest[:2], digest[2:4], "Danbooru_3.png")
+    assert (tmp_path / relative).read_bytes() == body
+    assert as_mock(context.database.insert_post_data).call_args.args[0].file_path == relative
+
+
+def test_move_library_file_can_be_repeated(tmp_path):
+    (tmp_path / "Danbooru_1.png").write_bytes(b"file")
+    target = str(tmp_path / "00000" / "Danbooru_1.png")
+
+    assert move_library_file(str(tmp_path), str(tmp_path / "Danbooru_1.png"), target)
+    assert move_library_file(str(tmp_path), str(tmp_path / "Danbooru_1.png"), target)
+    assert not move_library_file(str(tmp_path), str(tmp_path / "Danbooru_2.png"), str(tmp_path / "00000" / "Danbooru_2.png"))
+
+
+@pytest.fixture
+def flat_library(tmp_path, monkeypatch):
+    files = tmp_path / "files"
+    files.mkdir()
+    monkeypatch.setenv("ACCOUNT_NAME", "testAccount")
+    monkeypatch.setenv("API_KEY", "apiKey")
+    monkeypatch.setenv("DB_LOCATION", str(tmp_path))
+    monkeypatch.setenv("FILE_DIRECTORY", str(files))
+    with Database(str(tmp_path / "post-downloads.db")) as db:
+        for post_id in (1, 1001, 2002):
+            content = f"post {post_id}".encode()
+            (files / f"Danbooru_{post_id}.png").write_bytes(content)
+            db.insert_post_data(PostMetaData(post_id, md5=md5(content).hexdigest(), file_ext="png"))
+    return tmp_path
+
+
+def stored_paths(library) -> dict[int, str]:
+    with Database(str(library / "post-downloads.db")) as db:
+        return {post_id: path for post_id, _, _, path in db.get_all_posts()}
+
+
+def test_migrate_library_moves_files_and_records_paths(flat_library, monkeypatch):
+    monkeypatch.setenv("FILE_LAYOUT", "id")
+    verify_library() # fills the hash cache, which has to follow the files
+
+    migrate_library()
+
+    files = flat_library / "files"
+    assert stored_paths(flat_library) == {1: os.path.join("00000", "Danbooru_1.png"),
+                                          1001: os.path.join("00001", "Danbooru_1001.png"),
+                                          2002: os.path.join("00002", "Danbooru_2002.png")}
+    assert (files / "00001" / "Danbooru_1001.png").read_bytes() == b"post 1001"
+    assert not (files / "Danbooru_1.png").exists()
+    with patch("danbooru_favourites_downloader.main.hash_for_verify") as mock_hash:
+        verify_library()
+        assert mock_hash.call_count == 0
+
+
+def test_migrate_library_resumes_and_switches_layouts(flat_library, monkeypatch):
+    files = flat_library / "files"
+    monkeypatch.setenv("FILE_LAYOUT", "id")
+    # interrupted after moving the file but before recording its new path
+    os.makedirs(files / "00000")
+    os.replace(files / "Danbooru_1.png", files / "00000" / "Danbooru_1.png")
+    migrate_library()
+    assert stored_paths(flat_library)[1] == os.path.join("00000", "Danbooru_1.png")
+
+    monkeypatch.setenv("FILE_LAYOUT", "flat")
+    migrate_library()
+
+    assert stored_paths(flat_library) == {1: "Danbooru_1.png", 1001: "Danbooru_1001.png", 2002: "Danbooru_2002.png"}
+    assert sorted(os.listdir(files)) == ["Danbooru_1.png", "Danbooru_1001.png", "Danbooru_2002.png"]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("kind", ["ugoira", "variant"])
+async def test_new_downloads_stay_where_migrate_expects_them(context: Context, tmp_path, monkeypatch, capsys, kind):
+    files = tmp_path / "files"
+    for name, value in {"ACCOUNT_NAME": "testAccount", "API_KEY": "apiKey", "DB_LOCATION": str(tmp_path),
+                        "FILE_DIRECTORY": str(files), "FILE_LAYOUT": "md5"}.items():
+        monkeypatch.setenv(name, value)
+    context.environment.file_directory = str(files)
+    context.environment.file_layout = "md5"
+    context.database = Database(str(tmp_path / "post-downloads.db"))
+    if kind == "ugoira":
+        zip_file = io.BytesIO()
+        write_ugoira(zip_file, 3)
+        body = zip_file.getvalue()
+        api_md5 = md5(body).hexdigest()
+        post = PostRecord(id=7, file_url="https://cdn.donmai.us/original/7.zip", file_ext="zip", md5=api_md5)
+    else:
+        body = os.urandom(1000)
+        api_md5 = "ab" * 16 # of the original, not of the variant
+        post = PostRecord(id=7, file_url="https://cdn.donmai.us/720x720/7.webp", file_ext="webp", md5=api_md5, variant="720x720")
+
+    with aioresponses() as m:
+        m.get(post.file_url, body=body)
+        result = await download_file(context, post)
+    assert await md5_check(context, result)
+    if kind == "ugoira":
+        conversions: asyncio.Queue = asyncio.Queue()
+        await conversions.put(result)
+        await conversions.put(None)
+        assert await conversion_worker(context, conversions, lambda: None) == (1, 0)
+    else:
+        await handle_result(context, result)
+    context.database.close()
+    capsys.readouterr()
+
+    migrate_library()
+
+    assert "0 files need to be moved" in capsys.readouterr().out
+    assert stored_paths(tmp_path) == {7: os.path.join(api_md5[:2], api_md5[2:4], "Danbooru_7.webp")}
@@ -0,0 +1,54 @@
+import os
+import pytest
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader.main import download_limiter, find_local_copy, md5_check, Context
+from tests.utils import as_mock
+
+
+@pytest.mark.asyncio()
+async def test_existing_file_is_reused_without_downloading(context: Context, file_directory, make_post):
+    body = os.urandom(10_000)
+    post = make_post(1, body)
+    (file_directory / "Danbooru_1.png").write_bytes(body)
+    (file_directory / "Danbooru_1.png.part").write_bytes(b"stale")
+
+    with aioresponses() as m:
+        result = await download_limiter(context, post)
+        assert len(m.requests) == 0
+
+    assert result.success
+    assert await md5_check(context, result)
+    assert (file_directory / "Danbooru_1.png").read_bytes() == body
+    assert not (file_directory / "Danbooru_1.png.part").exists()
+
+
+@pytest.mark.asyncio()
+async def test_file_of_other_post_with_same_md5_is_linked(context: Context, file_directory, make_post):
+    body = os.urandom(10_000)
+    post = make_post(2, body, "jpg")
+    (file_directory / "Danbooru_99.jpg").write_bytes(body)
+    as_mock(context.database.get_posts_by_md5).return_value = [(99, "jpg", None)]
+
+    result = await find_local_copy(context, post)
+
+    assert result is not None and result.md5 == post.md5
+    assert (file_directory / "Danbooru_2.jpg").read_bytes() == body
+    assert os.path.samefile(file_directory / "Danbooru_2.jpg", file_directory / "Danbooru_99.jpg")
+
+
+@pytest.mark.asyncio()
+async def test_corrupted_file_is_not_reused(context: Context, file_directory, make_post):
+    post = make_post(3, b"the real content")
+    (file_directory / "Danbooru_3.png").write_bytes(b"truncated")
+
+    assert await find_local_copy(context, post) is None
+
+
+@pytest.mark.asyncio()
+async def test_ugoira_is_not_reused_when_converting(context: Context, file_directory, make_post):
+    body = b"zip bytes"
+    post = make_post(4, body, "zip")
+    (file_directory / "Danbooru_4.zip").write_bytes(body)
+
+    assert await find_local_copy(context, post) is None
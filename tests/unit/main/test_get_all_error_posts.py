@@ -0,0 +1,55 @@
+import pytest
+from aioresponses import aioresponses, CallbackResult
+from yarl import URL
+import re
+import asyncio
+
+from danbooru_favourites_downloader.main import get_all_error_posts, RETRY_BATCH_SIZE, Context
+from tests.utils import as_mock, collect
+
+
+@pytest.mark.asyncio()
+async def test_get_all_error_posts_batches_ids(context: Context):
+    error_ids = list(range(1, RETRY_BATCH_SIZE + 51))
+    as_mock(context.database.get_error_ids).return_value = error_ids
+    requested_batches = []
+
+    def callback(url:URL, **kwargs):
+        ids = kwargs["params"]["tags"].split()[0].removeprefix("id:").split(",")
+        requested_batches.append(len(ids))
+        return CallbackResult(status=200, payload=[{"id": int(id)} for id in ids if int(id) != 7])
+
+    with aioresponses() as m:
+        m.get(re.compile(r"https://danbooru\.donmai\.us/posts\.json.*"), callback=callback, repeat=True)
+        posts = await collect(get_all_error_posts(context))
+
+    assert sorted(requested_batches) == [50, RETRY_BATCH_SIZE]
+    assert sorted(p['id'] for p in posts) == [id for id in error_ids if id != 7]
+    as_mock(context.database.remove_from_error).assert_called_once_with(7)
+
+
+@pytest.mark.asyncio()
+async def test_get_all_error_posts_without_errors(context: Context):
+    as_mock(context.database.get_error_ids).return_value = []
+
+    with aioresponses() as m:
+        posts = await collect(get_all_error_posts(context))
+
+    assert posts == []
+    assert len(m.requests) == 0
+
+
+@pytest.mark.asyncio()
+async def test_get_all_error_posts_cancels_other_batches_on_failure(context: Context):
+    as_mock(context.database.get_error_ids).return_value = list(range(1, RETRY_BATCH_SIZE * 2 + 1))
+    url_pattern = re.compile(r"https://danbooru\.donmai\.us/posts\.json.*")
+
+    with aioresponses() as m:
+        m.get(url_pattern, status=500)
+        m.get(url_pattern, payload=[], repeat=True)
+        with pytest.raises(Exception):
+            await collect(get_all_error_posts(context))
+
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    assert pending == []
+    as_mock(context.database.remove_from_error).assert_not_called()
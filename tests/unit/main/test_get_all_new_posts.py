@@ -1,7 +1,8 @@
 import pytest
 from aioresponses import aioresponses
 
-from danbooru_favourites_downloader.main import get_all_new_posts, Context
+from danbooru_favourites_downloader.main import get_all_new_posts, supports_cursor_paging, POST_FIELDS, Context
+from tests.utils import collect
 
 
 @pytest.mark.asyncio()
@@ -11,20 +12,47 @@ async def test_get_all_new_posts(context: Context):
 
     with aioresponses() as m:
         m.get(
-            f"{url}?tags=ordfav:{un}&limit=20&page=1",
+            f"{url}?tags=ordfav:{un}&limit=200&page=1&only={POST_FIELDS}",
             payload=[{"id": 1, "other": 99}, {"id": 2, "other": 99}, {"id": 3, "other": 99}]
         )
         m.get(
-             f"{url}?tags=ordfav:{un}&limit=20&page=2",
+             f"{url}?tags=ordfav:{un}&limit=200&page=2&only={POST_FIELDS}",
              payload=[{"id": 4}, {"id": 5},{"id": 6}]
         )
         m.get(
-            f"{url}?tags=ordfav:{un}&limit=20&page=3",
+            f"{url}?tags=ordfav:{un}&limit=200&page=3&only={POST_FIELDS}",
             payload=[{"id": 7}, {"id": 8},{"id": 9}]
         )
 
-        posts = await get_all_new_posts(context=context, latest_id=8)
+        posts = await collect(get_all_new_posts(context=context, latest_id=8))
 
     assert len(posts) == 7
     assert posts[1]['id'] == 2
     assert 9 not in [p['id'] for p in posts]
+    assert context.metrics.stages["decode"].count == 3
+    assert context.metrics.counters["listing_bytes"] > 0
+
+
+@pytest.mark.asyncio()
+async def test_get_all_new_posts_cursor_paging(context: Context):
+    url = context.urls.base_url + context.urls.search_result_endpoint
+
+    with aioresponses() as m:
+        m.get(f"{url}?tags=fav:someone&limit=200&page=1&only={POST_FIELDS}", payload=[{"id": 90}, {"id": 80}, {"id": 70}])
+        m.get(f"{url}?tags=fav:someone&limit=200&page=b70&only={POST_FIELDS}", payload=[{"id": 60}, {"id": 50}, {"id": 40}])
+
+        # 55 is gone from the results, paging still stops at the first older id
+        posts = await collect(get_all_new_posts(context=context, latest_id=55, tags="fav:someone"))
+
+    assert [p['id'] for p in posts] == [90, 80, 70, 60]
+
+
+@pytest.mark.parametrize("tags, expected", [
+    ("ordfav:someone", False),
+    ("cat_ears order:score", False),
+    ("fav:someone", True),
+    ("cat_ears -order:rank rating:g", False),
+    ("pool:123", True),
+])
+def test_supports_cursor_paging(tags, expected):
+    assert supports_cursor_paging(tags) == expected
@@ -2,7 +2,7 @@ from unittest.mock import AsyncMock, Mock, patch
 import pytest
 from typing import cast
 
-from danbooru_favourites_downloader.main import DownloadMode, handle_result, Context
+from danbooru_favourites_downloader.main import DownloadMode, DownloadResult, PostRecord, handle_result, Context
 from danbooru_favourites_downloader.database import PostMetaData
 from tests.utils import as_mock
 
@@ -10,20 +10,13 @@ from tests.utils import as_mock
 
 @pytest.fixture
 def sample_post():
-    return {
-        "id": 123,
-        "md5": "SADbjf5349bg78D",
-        "tag_string_general": "tag1 tag2",
-        "tag_string_character": "",
-        "tag_string_copyright": "",
-        "tag_string_artist": "",
-        "tag_string_meta": "",
-        "rating": "g",
-        "parent_id": None,
-        "has_children": False,
-        "has_active_children": False,
-        "file_ext": "jpg",
-    }
+    return PostRecord(
+        id=123,
+        md5="SADbjf5349bg78D",
+        tag_string_general="tag1 tag2",
+        rating="g",
+        file_ext="jpg",
+    )
 
 @pytest.fixture
 def sample_post_meta_data():
@@ -45,7 +38,7 @@ def sample_post_meta_data():
 
 @pytest.mark.asyncio()
 async def test_handle_result_success_normal(context: Context, sample_post, sample_post_meta_data):
-    sample_ret = (True, sample_post)
+    sample_ret = DownloadResult(True, sample_post)
     
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)                                         
@@ -58,7 +51,7 @@ async def test_handle_result_success_normal(context: Context, sample_post, sampl
 
 @pytest.mark.asyncio()
 async def test_handle_result_failure_normal(context: Context, sample_post):
-    sample_ret = (False, sample_post)
+    sample_ret = DownloadResult(False, sample_post)
 
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)   
@@ -67,13 +60,13 @@ async def test_handle_result_failure_normal(context: Context, sample_post):
     assert errors == 1
     as_mock(context.database.insert_post_data).assert_not_called()
     as_mock(context.database.remove_from_error).assert_not_called()
-    as_mock(context.database.insert_id_to_error).assert_called_once_with(sample_post.get('id','ASSERT_FAILURE'))
+    as_mock(context.database.insert_id_to_error).assert_called_once_with(sample_post.id)
 
 
 @pytest.mark.asyncio()
 async def test_handle_result_success_retry(context: Context, sample_post, sample_post_meta_data):
     context.mode = DownloadMode.RETRY
-    sample_ret = (True, sample_post)
+    sample_ret = DownloadResult(True, sample_post)
 
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)                                         
@@ -88,7 +81,7 @@ async def test_handle_result_success_retry(context: Context, sample_post, sample
 @pytest.mark.asyncio()
 async def test_handle_result_failure_retry(context: Context, sample_post):
     context.mode = DownloadMode.RETRY
-    sample_ret = (False, sample_post)
+    sample_ret = DownloadResult(False, sample_post)
 
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)   
@@ -104,7 +97,7 @@ async def test_handle_result_failure_retry(context: Context, sample_post):
 @pytest.mark.asyncio()
 async def test_handle_result_success_force(context: Context, sample_post, sample_post_meta_data):
     context.mode = DownloadMode.FORCE
-    sample_ret = (True, sample_post)
+    sample_ret = DownloadResult(True, sample_post)
 
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)                                         
@@ -118,7 +111,7 @@ async def test_handle_result_success_force(context: Context, sample_post, sample
 @pytest.mark.asyncio()
 async def test_handle_result_failure_force(context: Context, sample_post):
     context.mode = DownloadMode.FORCE
-    sample_ret = (False, sample_post)
+    sample_ret = DownloadResult(False, sample_post)
 
     with patch("danbooru_favourites_downloader.main.build_metadata", return_value=sample_post_meta_data) as mock_build:
         success, errors = await handle_result(context, sample_ret)   
@@ -127,4 +120,4 @@ async def test_handle_result_failure_force(context: Context, sample_post):
     assert errors == 1
     as_mock(context.database.insert_post_data).assert_not_called()
     as_mock(context.database.remove_from_error).assert_not_called()
-    as_mock(context.database.insert_id_to_error).assert_called_once_with(sample_post.get('id','ASSERT_FAILURE'))
+    as_mock(context.database.insert_id_to_error).assert_called_once_with(sample_post.id)
@@ -0,0 +1,21 @@
+import pytest
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader.main import rate_limited_get, Context
+
+
+@pytest.mark.asyncio()
+async def test_rate_limited_get_retries_after_429(context: Context):
+    url = context.urls.base_url + context.urls.search_result_endpoint
+
+    with aioresponses() as m:
+        m.get(url, status=429, headers={"Retry-After": "0.1"})
+        m.get(url, payload=[{"id": 1}])
+
+        async with rate_limited_get(context, url) as resp:
+            assert resp.status == 200
+            assert await resp.json() == [{"id": 1}]
+
+    assert context.rate_limiter.requests == 2
+    assert context.rate_limiter.throttled == 1
+    assert context.rate_limiter.total_wait >= 0.09
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from hashlib import md5
+from unittest.mock import Mock, patch
+
+from danbooru_favourites_downloader.main import is_post_intact, download_worker, DownloadMode, DownloadResult, PostRecord, Context
+from tests.utils import as_mock
+
+
+@pytest.mark.asyncio()
+async def test_intact_post(context: Context, file_directory):
+    (file_directory / "Danbooru_1.webp").write_bytes(b"converted ugoira")
+    as_mock(context.database.get_post).return_value = (md5(b"converted ugoira").hexdigest(), "webp", None)
+
+    assert await is_post_intact(context, PostRecord(id=1, file_ext="zip"))
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("recorded, content", [
+    (None, b"file without a database row"),
+    (("0" * 32, "png", None), b"corrupted"),
+    ((md5(b"gone").hexdigest(), "png", None), None),
+])
+async def test_post_needs_repair(context: Context, file_directory, recorded, content):
+    if content is not None:
+        (file_directory / "Danbooru_2.png").write_bytes(content)
+    as_mock(context.database.get_post).return_value = recorded
+
+    assert not await is_post_intact(context, PostRecord(id=2, file_ext="png"))
+
+
+@pytest.mark.asyncio()
+async def test_reconcile_only_downloads_posts_needing_repair(context: Context):
+    context.mode = DownloadMode.RECONCILE
+    queue: asyncio.Queue = asyncio.Queue()
+    for post in [PostRecord(id=1), PostRecord(id=2), PostRecord(id=3), None]:
+        await queue.put(post)
+    bar = Mock()
+
+    with (patch("danbooru_favourites_downloader.main.is_post_intact", side_effect=lambda _, post: post.id != 2),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=lambda _, post: DownloadResult(True, post)) as mock_download,
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.finish_download", return_value=(1, 0))):
+        result = await download_worker(context, queue, asyncio.Queue(), bar)
+
+    assert result == (1, 0)
+    assert [call.args[1].id for call in mock_download.call_args_list] == [2]
+    assert bar.call_count == 3
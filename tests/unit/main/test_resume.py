@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from unittest.mock import Mock, patch
+
+from danbooru_favourites_downloader.main import (select_posts, produce_posts, download_worker, advance_watermarks,
+                                                 favourites_source, DownloadResult, DownloadMode, PostRecord, Context)
+from danbooru_favourites_downloader.database import Database
+from tests.utils import as_pages, collect
+
+
+@pytest.fixture
+def database(context: Context):
+    context.database = Database(":memory:")
+    yield context.database
+    context.database.close()
+
+
+def fake_listing(listings: dict):
+    # get_all_new_posts stand-in keyed by (latest_id, start_page), reports each page like the real one
+    async def get_all_new_posts(_, latest_id=0, tags=None, start_page=1, on_page=None):
+        for next_page, page in listings[(latest_id, start_page)]:
+            yield page
+            if on_page is not None:
+                on_page(next_page, page[0]['id'])
+    return get_all_new_posts
+
+
+@pytest.mark.asyncio()
+async def test_listing_progress_is_saved_per_page(context: Context, database: Database):
+    database.set_newest_downloaded_id(10)
+    listings = {(10, 1): [(2, [{"id": 30}, {"id": 29}]), (3, [{"id": 28}])]}
+
+    with patch("danbooru_favourites_downloader.main.get_all_new_posts", side_effect=fake_listing(listings)):
+        pages = select_posts(context)
+        await anext(pages)
+        assert database.get_run_state() is None # the consumer hasn't asked for the next page yet
+        await anext(pages)
+
+    assert database.get_run_state() == (30, "2")
+    assert database.get_newest_downloaded_id() == 10
+
+
+@pytest.mark.asyncio()
+async def test_interrupted_listing_is_resumed(context: Context, database: Database):
+    database.set_newest_downloaded_id(10)
+    database.set_run_state(30, "3")
+    listings = {
+        (30, 1): [(2, [{"id": 35}])], # favourited since the interruption
+        (10, 3): [(4, [{"id": 20}, {"id": 19}])],
+    }
+
+    with patch("danbooru_favourites_downloader.main.get_all_new_posts", side_effect=fake_listing(listings)):
+        posts = await collect(select_posts(context))
+
+    assert [post.id for post in posts] == [35, 20, 19]
+    assert database.get_run_state() == (35, "4")
+    advance_watermarks(context, {favourites_source("testAccount"): (35, True)})
+    assert database.get_newest_downloaded_id() == 35
+
+
+@pytest.mark.asyncio()
+async def test_left_over_posts_are_queued_first(context: Context, database: Database):
+    database.queue_posts([7, 6])
+    queue: asyncio.Queue = asyncio.Queue()
+
+    with (patch("danbooru_favourites_downloader.main.get_error_posts_batch", return_value=[{"id": 7}]),
+          patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages([PostRecord(id=9), PostRecord(id=7)]))):
+        await produce_posts(context, queue, 1)
+
+    assert [queue.get_nowait() for _ in range(queue.qsize())] == [PostRecord(id=7), PostRecord(id=9), None]
+    assert database.get_queued_ids() == [9, 7] # 6 is gone from Danbooru, 7 and 9 wait for their download
+
+
+@pytest.mark.asyncio()
+async def test_stopping_leaves_posts_queued(context: Context, database: Database):
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    downloaded = []
+
+    async def fake_download(_, post):
+        downloaded.append(post.id)
+        context.stopping.set()
+        return DownloadResult(True, post)
+
+    with (patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda *_: as_pages([PostRecord(id=3), PostRecord(id=2), PostRecord(id=1)])),
+          patch("danbooru_favourites_downloader.main.download_limiter", side_effect=fake_download),
+          patch("danbooru_favourites_downloader.main.md5_check", return_value=True),
+          patch("danbooru_favourites_downloader.main.build_metadata", return_value=Mock(file_path="")),
+          patch.object(database, "insert_post_data")):
+        worker = asyncio.create_task(download_worker(context, queue, asyncio.Queue(), Mock()))
+        progress = await asyncio.wait_for(produce_posts(context, queue, 1), 5)
+        await asyncio.wait_for(worker, 5)
+
+    assert downloaded == [3]
+    assert progress[None] == (3, False)
+    assert database.get_queued_ids() == [2, 1]
+
+
+def test_watermark_only_moves_for_complete_listings(context: Context):
+    cat, dog = Mock(checkpoint="tags:cat"), Mock(checkpoint="tags:dog")
+    advance_watermarks(context, {cat: (30, True), dog: (20, False)})
+
+    context.database.finish_run.assert_called_once_with("tags:cat")
+    context.database.set_newest_downloaded_id.assert_not_called()
+
+    context.mode = DownloadMode.FORCE
+    advance_watermarks(context, {cat: (30, True), dog: (20, False)})
+    context.database.set_newest_downloaded_id.assert_called_once_with(30, "tags:cat")
@@ -1,10 +1,10 @@
 from typing import Any
 import pytest
-from unittest.mock import AsyncMock, Mock, patch
+from unittest.mock import ANY, AsyncMock, Mock, patch
 
-from danbooru_favourites_downloader.main import select_posts, DownloadMode, Context
+from danbooru_favourites_downloader.main import select_posts, DownloadMode, PostRecord, Context
 from danbooru_favourites_downloader.database import Database
-from tests.utils import as_mock
+from tests.utils import as_mock, as_pages, collect
 
 @pytest.fixture
 def fake_data():
@@ -31,7 +31,7 @@ def fake_data():
             DownloadMode.NORMAL,
             "get_all_new_posts",
             #lambda session, db: ((),{"session": session, "latest_id": 123, "un": "username"}),
-            lambda v: ((v, 123),{}),
+            lambda v: ((v, 123, "ordfav:testAccount"),{"on_page": ANY}),
             True,
         ),
         (
@@ -43,7 +43,13 @@ def fake_data():
         (
             DownloadMode.FORCE,
             "get_all_new_posts",
-            lambda v: ((v,),{}),
+            lambda v: ((v,),{"tags": "ordfav:testAccount"}),
+            False,
+        ),
+        (
+            DownloadMode.RECONCILE,
+            "get_all_new_posts",
+            lambda v: ((v,),{"tags": "ordfav:testAccount"}),
             False,
         ),
     ],
@@ -53,12 +59,13 @@ async def test_select_posts(context: Context, fake_data,
     context.mode = mode
 
     as_mock(context.database.get_newest_downloaded_id).return_value = 123
+    as_mock(context.database.get_run_state).return_value = None
 
-    with (patch("danbooru_favourites_downloader.main.get_all_new_posts", return_value=fake_data) as mock_new,
-          patch("danbooru_favourites_downloader.main.get_all_error_posts", return_value=fake_data) as mock_error):
-        result = await select_posts(context)
+    with (patch("danbooru_favourites_downloader.main.get_all_new_posts", side_effect=lambda *_, **__: as_pages(fake_data)) as mock_new,
+          patch("danbooru_favourites_downloader.main.get_all_error_posts", side_effect=lambda *_: as_pages(fake_data)) as mock_error):
+        result = await collect(select_posts(context))
 
-    assert result == fake_data
+    assert result == [PostRecord.from_json(post) for post in fake_data]
     assert as_mock(context.database.get_newest_downloaded_id).call_count == (1 if expects_db_call else 0)
     mock = mock_new if expected_fn == "get_all_new_posts" else mock_error
     args, kwargs = expected_kw_args(context)
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from unittest.mock import ANY, patch
+
+from danbooru_favourites_downloader.main import parse_sources, select_posts, produce_posts, PostRecord, Source, Context
+from tests.utils import as_mock, as_pages, collect
+
+
+def test_empty_sources_default_to_own_favourites():
+    assert parse_sources("", "alice") == [Source("favourites:alice", "ordfav:alice")]
+
+
+def test_parse_sources():
+    sources = parse_sources("favourites:alice; favourites:bob ;tags:cat_ears rating:g; pool:123;", "alice")
+
+    assert sources == [
+        Source("favourites:alice", "ordfav:alice"),
+        Source("favourites:bob", "ordfav:bob", "favourites:bob"),
+        Source("tags:cat_ears rating:g", "cat_ears rating:g", "tags:cat_ears rating:g"),
+        Source("pool:123", "pool:123", "pool:123"),
+    ]
+
+
+def test_duplicate_sources_are_listed_once():
+    assert len(parse_sources("tags:cat; tags:cat", "alice")) == 1
+
+
+@pytest.mark.parametrize("value", ["artist:someone", "tags:", "pool:abc", "favourites"])
+def test_malformed_sources_are_rejected(value):
+    with pytest.raises(SystemExit):
+        parse_sources(value, "alice")
+
+
+@pytest.mark.asyncio()
+async def test_source_uses_its_own_checkpoint(context: Context):
+    source = Source("tags:cat", "cat", "tags:cat")
+    as_mock(context.database.get_newest_downloaded_id).return_value = 50
+    as_mock(context.database.get_run_state).return_value = None
+
+    with patch("danbooru_favourites_downloader.main.get_all_new_posts", side_effect=lambda *_, **__: as_pages([{"id": 60}])) as mock_new:
+        await collect(select_posts(context, source))
+
+    as_mock(context.database.get_newest_downloaded_id).assert_called_once_with("tags:cat")
+    mock_new.assert_called_once_with(context, 50, "cat", on_page=ANY)
+
+
+@pytest.mark.asyncio()
+async def test_sources_share_the_queue_fairly_and_skip_duplicates(context: Context):
+    first = Source("tags:a", "a", "tags:a")
+    second = Source("tags:b", "b", "tags:b")
+    context.sources = [first, second]
+    pages = {
+        "a": [[PostRecord(id=10), PostRecord(id=9), PostRecord(id=8)], [PostRecord(id=7)]],
+        "b": [[PostRecord(id=20), PostRecord(id=9), PostRecord(id=19)], [PostRecord(id=18)]],
+    }
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    order = []
+
+    async def consume():
+        while (post := await queue.get()) is not None:
+            order.append(post.id)
+            await asyncio.sleep(0)
+
+    with patch("danbooru_favourites_downloader.main.select_posts", side_effect=lambda _, source: as_pages(*pages[source.tags])):
+        consumer = asyncio.create_task(consume())
+        progress = await produce_posts(context, queue, 1)
+        await consumer
+
+    assert progress == {first: (10, True), second: (20, True)}
+    assert sorted(order) == [7, 8, 9, 10, 18, 19, 20]
+    # the second source gets its turn before the first one is finished
+    assert order.index(20) < order.index(8)
@@ -0,0 +1,32 @@
+import pytest
+
+from danbooru_favourites_downloader.main import validate_environment_variables, Environment
+
+
+@pytest.mark.parametrize("rate_limit, burst", [(0, 100), (-1, 100), (10, 0)])
+def test_invalid_rate_limit_is_rejected(tmp_path, rate_limit, burst):
+    env = Environment("account", "key", str(tmp_path), str(tmp_path), False, rate_limit, burst)
+
+    with pytest.raises(SystemExit):
+        validate_environment_variables(env)
+
+
+def test_conversion_workers_are_clamped(tmp_path):
+    env = Environment("account", "key", str(tmp_path), str(tmp_path), True, conversion_workers=64)
+    validate_environment_variables(env)
+
+    assert env.conversion_workers == 8
+
+
+def test_invalid_max_downloads_is_rejected(tmp_path):
+    env = Environment("account", "key", str(tmp_path), str(tmp_path), False, max_downloads=0)
+
+    with pytest.raises(SystemExit):
+        validate_environment_variables(env)
+
+
+def test_negative_download_retries_are_rejected(tmp_path):
+    env = Environment("account", "key", str(tmp_path), str(tmp_path), False, download_retries=-1)
+
+    with pytest.raises(SystemExit):
+        validate_environment_variables(env)
@@ -0,0 +1,102 @@
+import os
+import pytest
+from hashlib import md5
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader.main import (parse_variant_policy, choose_variant, download_limiter, md5_check, handle_result,
+                                                 VariantPolicy, PostRecord, DownloadResult, Context)
+from tests.utils import as_mock
+
+
+def make_post(file_ext: str = "png", file_size: int = 4_000_000) -> dict:
+    return {
+        "id": 1,
+        "md5": "0" * 32,
+        "file_ext": file_ext,
+        "file_url": f"https://cdn.donmai.us/original/1.{file_ext}",
+        "media_asset": {
+            "file_size": file_size,
+            "image_width": 2000,
+            "image_height": 2000,
+            "variants": [
+                {"type": "180x180", "url": "https://cdn.donmai.us/180x180/1.jpg", "width": 180, "height": 180, "file_ext": "jpg"},
+                {"type": "720x720", "url": "https://cdn.donmai.us/720x720/1.webp", "width": 720, "height": 720, "file_ext": "webp"},
+                {"type": "sample", "url": "https://cdn.donmai.us/sample/1.jpg", "width": 850, "height": 850, "file_ext": "jpg"},
+                {"type": "original", "url": f"https://cdn.donmai.us/original/1.{file_ext}", "width": 2000, "height": 2000, "file_ext": file_ext},
+            ],
+        },
+    }
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("original", VariantPolicy()),
+    ("max_pixels:1000000", VariantPolicy("max_pixels", limit=1_000_000)),
+    ("Format:WEBP", VariantPolicy("format", file_ext="webp")),
+    ("max_bytes:500000", VariantPolicy("max_bytes", limit=500_000)),
+])
+def test_parse_variant_policy(value, expected):
+    assert parse_variant_policy(value) == expected
+
+
+@pytest.mark.parametrize("value", ["sample", "max_pixels:", "max_pixels:0", "max_bytes:1e6", "format:", "original:1"])
+def test_malformed_variant_policy_is_rejected(value):
+    with pytest.raises(SystemExit):
+        parse_variant_policy(value)
+
+
+@pytest.mark.parametrize("policy, expected", [
+    (VariantPolicy(), None),
+    (VariantPolicy("max_pixels", limit=800_000), "sample"),
+    (VariantPolicy("max_pixels", limit=600_000), "720x720"),
+    (VariantPolicy("max_pixels", limit=100), "180x180"), # nothing fits, the smallest comes closest
+    (VariantPolicy("max_pixels", limit=5_000_000), None),
+    (VariantPolicy("format", file_ext="webp"), "720x720"),
+    (VariantPolicy("format", file_ext="png"), None),
+    (VariantPolicy("format", file_ext="avif"), None),
+    (VariantPolicy("max_bytes", limit=600_000), "720x720"), # sample is estimated at 722 KB
+    (VariantPolicy("max_bytes", limit=5_000_000), None),
+])
+def test_choose_variant(policy, expected):
+    variant = choose_variant(make_post(), policy)
+    assert (variant and variant["type"]) == expected
+
+
+def test_animations_keep_their_original():
+    assert choose_variant(make_post("mp4"), VariantPolicy("max_pixels", limit=100_000)) is None
+
+
+def test_post_record_uses_the_chosen_variant():
+    post = PostRecord.from_json(make_post(), VariantPolicy("format", file_ext="webp"))
+
+    assert (post.variant, post.file_ext, post.file_url) == ("720x720", "webp", "https://cdn.donmai.us/720x720/1.webp")
+    assert post.md5 == "0" * 32
+
+
+@pytest.mark.asyncio()
+async def test_variant_is_recorded_with_its_own_hash(context: Context, tmp_path):
+    context.environment.file_directory = str(tmp_path)
+    as_mock(context.database.get_posts_by_md5).return_value = []
+    post = PostRecord.from_json(make_post(), VariantPolicy("format", file_ext="webp"))
+    body = os.urandom(2000)
+
+    with aioresponses() as m:
+        m.get(post.file_url, body=body)
+        result = await download_limiter(context, post)
+    assert await md5_check(context, result) # the API md5 is the original's and doesn't match
+    await handle_result(context, result)
+
+    assert (tmp_path / "Danbooru_1.webp").read_bytes() == body
+    metadata = as_mock(context.database.insert_post_data).call_args.args[0]
+    assert (metadata.md5, metadata.variant, metadata.file_ext) == (md5(body).hexdigest(), "720x720", "webp")
+    assert metadata.api_md5 == "0" * 32
+    as_mock(context.database.get_posts_by_md5).assert_not_called()
+
+
+@pytest.mark.asyncio()
+async def test_original_still_has_to_match_the_api_md5(context: Context, tmp_path):
+    context.environment.file_directory = str(tmp_path)
+    partial = tmp_path / "Danbooru_1.png.part"
+    partial.write_bytes(b"data")
+    result = DownloadResult(True, PostRecord.from_json(make_post()), md5(b"data").hexdigest(), path=str(tmp_path / "Danbooru_1.png"))
+
+    assert not await md5_check(context, result)
@@ -0,0 +1,49 @@
+import os
+import pytest
+from hashlib import md5
+from unittest.mock import patch
+
+from danbooru_favourites_downloader.main import verify_library, hash_for_verify
+from danbooru_favourites_downloader.database import Database, PostMetaData
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    files = tmp_path / "files"
+    files.mkdir()
+    monkeypatch.setenv("ACCOUNT_NAME", "testAccount")
+    monkeypatch.setenv("API_KEY", "apiKey")
+    monkeypatch.setenv("DB_LOCATION", str(tmp_path))
+    monkeypatch.setenv("FILE_DIRECTORY", str(files))
+
+    with Database(str(tmp_path / "post-downloads.db")) as db:
+        for post_id, content in [(1, b"good"), (2, b"will be damaged"), (3, b"will be deleted")]:
+            (files / f"Danbooru_{post_id}.png").write_bytes(content)
+            db.insert_post_data(PostMetaData(post_id, md5=md5(content).hexdigest(), file_ext="png"))
+    (files / "Danbooru_2.png").write_bytes(b"damaged")
+    os.remove(files / "Danbooru_3.png")
+    return tmp_path
+
+
+def error_ids(library) -> list[int]:
+    with Database(str(library / "post-downloads.db")) as db:
+        return sorted(db.get_error_ids())
+
+
+def test_verify_library_marks_damaged_files(library):
+    verify_library()
+
+    assert error_ids(library) == [2, 3]
+
+
+def test_verify_library_uses_cached_hashes(library):
+    verify_library()
+    with patch("danbooru_favourites_downloader.main.hash_for_verify", side_effect=hash_for_verify) as mock_hash:
+        verify_library()
+        assert mock_hash.call_count == 0
+
+        (library / "files" / "Danbooru_1.png").write_bytes(b"changed later")
+        verify_library()
+        assert [call.args[0] for call in mock_hash.call_args_list] == [str(library / "files" / "Danbooru_1.png")]
+
+    assert error_ids(library) == [1, 2, 3]
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from aioresponses import aioresponses
+
+from danbooru_favourites_downloader.main import has_new_posts, watch, DownloadMode, Source, Context
+from tests.utils import as_mock
+
+
+@pytest.mark.asyncio()
+async def test_has_new_posts_polls_first_post_only(context: Context):
+    url = context.urls.base_url + context.urls.search_result_endpoint
+    as_mock(context.database.get_newest_downloaded_id).return_value = 10
+
+    with aioresponses() as m:
+        m.get(f"{url}?tags=ordfav:testAccount&limit=1&only=id", payload=[{"id": 10}])
+        assert not await has_new_posts(context)
+        m.get(f"{url}?tags=ordfav:testAccount&limit=1&only=id", payload=[{"id": 11}])
+        assert await has_new_posts(context)
+
+
+@pytest.mark.asyncio()
+async def test_has_new_posts_checks_every_source(context: Context):
+    url = context.urls.base_url + context.urls.search_result_endpoint
+    context.sources = [Source("tags:a", "a", "tags:a"), Source("tags:b", "b", "tags:b")]
+    as_mock(context.database.get_newest_downloaded_id).side_effect = lambda source: {"tags:a": 5, "tags:b": 7}[source]
+
+    with aioresponses() as m:
+        m.get(f"{url}?tags=a&limit=1&only=id", payload=[{"id": 5}])
+        m.get(f"{url}?tags=b&limit=1&only=id", payload=[{"id": 8}])
+        assert await has_new_posts(context)
+
+
+@pytest.mark.asyncio()
+async def test_watch_only_runs_pipeline_when_something_changed(context: Context):
+    context.mode = DownloadMode.WATCH
+    context.environment.watch_interval = 0.001
+    checks = iter([False, True, False, False, False] + [False] * 1000)
+    runs = []
+
+    async def fake_run(ctx):
+        runs.append(ctx.mode)
+
+    with (patch("danbooru_favourites_downloader.main.has_new_posts", side_effect=lambda _: next(checks)),
+          patch("danbooru_favourites_downloader.main.run_pipeline", side_effect=fake_run)):
+        task = asyncio.create_task(watch(context))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # once to catch up on start, once for the change
+    assert runs == [DownloadMode.NORMAL, DownloadMode.NORMAL]
+
+
+@pytest.mark.asyncio()
+async def test_watch_survives_failed_checks(context: Context):
+    context.environment.watch_interval = 0.001
+    calls = 0
+
+    async def failing_check(_):
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("offline")
+
+    with (patch("danbooru_favourites_downloader.main.has_new_posts", side_effect=failing_check),
+          patch("danbooru_favourites_downloader.main.run_pipeline")):
+        task = asyncio.create_task(watch(context))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert calls > 1
+
+
+@pytest.mark.asyncio()
+async def test_watch_reports_rate_limiter_counters_per_round(context: Context):
+    context.environment.watch_interval = 0.001
+    checks = iter([True] * 1000)
+    seen = []
+
+    async def fake_run(ctx):
+        seen.append((ctx.rate_limiter.requests, ctx.rate_limiter.throttled, ctx.rate_limiter.total_wait))
+        await ctx.rate_limiter.acquire()
+        ctx.rate_limiter.penalize(0)
+
+    with (patch("danbooru_favourites_downloader.main.has_new_posts", side_effect=lambda _: next(checks)),
+          patch("danbooru_favourites_downloader.main.run_pipeline", side_effect=fake_run)):
+        task = asyncio.create_task(watch(context))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert len(seen) > 1
+    assert all(counters == (0, 0, 0.0) for counters in seen)
@@ -0,0 +1,72 @@
+import json
+import pytest
+
+from danbooru_favourites_downloader.metrics import Metrics, Histogram
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram()
+    for value in [0.002] * 90 + [0.2] * 9 + [4.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.sum == pytest.approx(0.18 + 1.8 + 4.0)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.95) == 0.25
+    assert histogram.quantile(1.0) == 4.0
+
+
+def test_time_records_stage_even_when_it_raises():
+    metrics = Metrics()
+    with metrics.time("download"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.time("download"):
+            raise RuntimeError()
+
+    assert metrics.stages["download"].count == 2
+
+
+def test_json_report(tmp_path):
+    metrics = Metrics()
+    with metrics.time("list"):
+        pass
+    metrics.count("downloaded_bytes", 4096)
+    metrics.count_request(200)
+    metrics.count_request(200)
+    metrics.count_request(503)
+    metrics.sample_queue("posts", 10)
+    metrics.sample_queue("posts", 30)
+    path = tmp_path / "metrics.json"
+
+    metrics.write_json(str(path))
+    report = json.loads(path.read_text())
+
+    assert report["counters"]["downloaded_bytes"] == 4096
+    assert report["requests"] == {"200": 2, "503": 1}
+    assert report["queues"]["posts"] == {"samples": 2, "mean": 20.0, "max": 30}
+    assert report["stages"]["list"]["count"] == 1
+    assert report["bytes_per_second"] > 0
+    assert not (tmp_path / "metrics.json.tmp").exists()
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = Metrics()
+    metrics.stages["download"] = Histogram()
+    metrics.stages["download"].observe(0.02)
+    metrics.stages["download"].observe(3.0)
+    metrics.count("posts_downloaded", 2)
+    metrics.count_request(429)
+    metrics.set_gauge("concurrency_peak", 6)
+    path = tmp_path / "danbooru.prom"
+
+    metrics.write_prometheus(str(path))
+    lines = path.read_text().splitlines()
+
+    assert 'danbooru_stage_duration_seconds_bucket{stage="download",le="0.025"} 1' in lines
+    assert 'danbooru_stage_duration_seconds_bucket{stage="download",le="5.0"} 2' in lines
+    assert 'danbooru_stage_duration_seconds_bucket{stage="download",le="+Inf"} 2' in lines
+    assert 'danbooru_stage_duration_seconds_count{stage="download"} 2' in lines
+    assert 'danbooru_posts_downloaded_total 2' in lines
+    assert 'danbooru_requests_total{status="429"} 1' in lines
+    assert 'danbooru_concurrency_peak 6' in lines
@@ -0,0 +1,40 @@
+import pytest
+from time import monotonic
+
+from danbooru_favourites_downloader.rate_limiter import RateLimiter, parse_retry_after
+
+
+@pytest.mark.asyncio()
+async def test_burst_does_not_wait():
+    limiter = RateLimiter(rate=1, burst=5)
+    start = monotonic()
+    for _ in range(5):
+        await limiter.acquire()
+
+    assert monotonic() - start < 0.1
+    assert limiter.requests == 5
+
+
+@pytest.mark.asyncio()
+async def test_refill_rate_applies_after_burst():
+    limiter = RateLimiter(rate=20, burst=2)
+    for _ in range(4):
+        await limiter.acquire()
+
+    # 2 requests had to wait for a token at 20 tokens per second
+    assert limiter.total_wait == pytest.approx(0.1, abs=0.05)
+
+
+@pytest.mark.asyncio()
+async def test_penalize_blocks_until_retry_after():
+    limiter = RateLimiter(rate=100, burst=100)
+    limiter.penalize(0.2)
+    waited = await limiter.acquire()
+
+    assert waited >= 0.19
+    assert limiter.throttled == 1
+
+
+@pytest.mark.parametrize("value, expected", [("3", 3.0), ("0.5", 0.5), (None, 1.0), ("Wed, 21 Oct 2015 07:28:00 GMT", 1.0)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
@@ -1,7 +1,31 @@
+import io
+import json
+import zipfile
 from typing import TypeVar, cast
 from unittest.mock import MagicMock
+from PIL import Image
 
 T = TypeVar("T")
 
 def as_mock(obj: T) -> MagicMock:
-    return cast(MagicMock, obj)
\ No newline at end of file
+    return cast(MagicMock, obj)
+
+async def collect(pages) -> list:
+    return [post async for page in pages for post in page]
+
+
+async def as_pages(*pages):
+    for page in pages:
+        yield page
+
+
+def write_ugoira(path, frame_count: int, with_meta: bool = True):
+    with zipfile.ZipFile(path, "w") as zip:
+        frames = []
+        for i in range(frame_count):
+            buffer = io.BytesIO()
+            Image.new("RGB", (16, 16), (i * 40 % 256, 0, 0)).save(buffer, format="PNG")
+            zip.writestr(f"{i:06d}.png", buffer.getvalue())
+            frames.append({"file": f"{i:06d}.png", "delay": 50 + i})
+        if with_meta:
+            zip.writestr("animation.json", json.dumps({"frames": frames}))